@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""قياس أداء البوت دون توكن حقيقي: معالجات bot.py الفعلية مع بديل محلي لـ Telegram Bot API.
+
+    python bench.py --updates 2000 --users 200 --mix menu=4,faq=3,booking=2,admin=1 --shards 8
+
+يطبع الإنتاجية وزمن المعالج (p50/p95/p99) وزمن قاعدة البيانات لكل تحديث،
+ومع --json يضيف سطراً بالنتيجة إلى ملف للمقارنة بين إعدادات التخزين والتوازي."""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from telegram.request import BaseRequest
+
+BENCH_ADMIN_ID = 1
+BOT_ID = 42
+
+
+class FakeBotAPI(BaseRequest):
+    """يرد على كل طلب بنجاح بعد تأخير latency ثانية (لمحاكاة زمن الشبكة) ويحصي الطلبات"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._ids = itertools.count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] = self.calls.get(name, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif name.startswith(("send", "edit", "forward")):
+            result = {
+                "message_id": next(self._ids), "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"}, "text": params.get("text", ""),
+            }
+        elif name == "copyMessage":
+            result = {"message_id": next(self._ids)}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# ==================== توليد التحديثات ====================
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "bench", "username": f"user{user_id}"}
+
+    def text(self, user_id, text):
+        update_id = next(self._ids)
+        message = {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id),
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def button(self, user_id, data):
+        update_id = next(self._ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self._user(user_id), "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "text": "-",
+                        "chat": {"id": user_id, "type": "private"}},
+        }}
+
+
+# كل سيناريو جلسة مستخدم واحد: قائمة تحديثات تُرسل بالترتيب
+def menu_session(f, user_id, bot):
+    return [f.text(user_id, "/start"), f.button(user_id, "show_menu"), f.button(user_id, "show_welcome"),
+            f.button(user_id, "show_menu"), f.button(user_id, "contact"), f.button(user_id, "back_menu")]
+
+
+def faq_session(f, user_id, bot):
+    faq_ids = list(bot.content.catalog.faq_answers)
+    return [f.button(user_id, "show_menu"), f.button(user_id, "faq"),
+            f.button(user_id, f"faq:{random.choice(faq_ids)}"), f.button(user_id, "faq"),
+            f.button(user_id, f"faq:{random.choice(faq_ids)}")]
+
+
+def booking_session(f, user_id, bot):
+    days = bot.slots.days()
+    if not days:
+        return inquiry_session(f, user_id, bot)
+    date = random.choice(days)
+    time_ = random.choice(bot.slots.slots(date))[0]
+    return [f.button(user_id, "book"), f.button(user_id, f"day:{date}"),
+            f.button(user_id, f"time:{date}:{bot.time_key(time_)}"),
+            f.text(user_id, "مستخدم تجريبي"), f.text(user_id, "07700000000")]
+
+
+def inquiry_session(f, user_id, bot):
+    step = random.choice(["ask", "edit_diet", "explain_analysis", "medical_diet", "daily_followup"])
+    return [f.button(user_id, "show_menu"), f.button(user_id, step), f.text(user_id, "نص تجريبي للطلب " * 5)]
+
+
+def admin_session(f, user_id, bot):
+    return [f.text(BENCH_ADMIN_ID, "/admin"), f.button(BENCH_ADMIN_ID, "admin_messages"),
+            f.button(BENCH_ADMIN_ID, "admin_msgs:inquiry:::"), f.button(BENCH_ADMIN_ID, "admin_bookings"),
+            f.button(BENCH_ADMIN_ID, "admin_stats"), f.button(BENCH_ADMIN_ID, "admin_stats:w")]
+
+
+SCENARIOS = {
+    "menu": menu_session,
+    "faq": faq_session,
+    "booking": booking_session,
+    "inquiry": inquiry_session,
+    "admin": admin_session,
+}
+
+
+def build_workload(bot, mix, users, total):
+    """جلسات عشوائية حسب الأوزان، متداخلة بين المستخدمين مع الحفاظ على ترتيب كل جلسة"""
+    f = UpdateFactory()
+    names, weights = zip(*mix.items())
+    pending = []
+    count = 0
+    while count < total:
+        user_id = 1000 + random.randrange(users)
+        session = SCENARIOS[random.choices(names, weights)[0]](f, user_id, bot)
+        pending.append(session)
+        count += len(session)
+    workload = []
+    while pending:
+        session = random.choice(pending)
+        workload.append(session.pop(0))
+        if not session:
+            pending.remove(session)
+    return workload[:total]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+# ==================== التشغيل ====================
+async def run(args):
+    import bot
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    api = FakeBotAPI(args.api_latency_ms / 1000)
+    processor = bot.ShardedUpdateProcessor(args.shards, args.max_pending) if args.shards else False
+    app = bot.build_application(concurrent_updates=processor, request=api, get_updates_request=FakeBotAPI())
+
+    started, queued, handler_ms, total_ms = {}, {}, [], []
+    done = asyncio.Event()
+    expected = 0
+
+    async def on_begin(update, context):
+        started[update.update_id] = time.perf_counter()
+
+    async def on_end(update, context):
+        now = time.perf_counter()
+        handler_ms.append((now - started.pop(update.update_id)) * 1000)
+        total_ms.append((now - queued.pop(update.update_id)) * 1000)
+        if len(total_ms) >= expected:
+            done.set()
+
+    # أول مجموعة وآخر مجموعة: تحيطان بكل معالجات البوت
+    app.add_handler(TypeHandler(Update, on_begin), group=-1000)
+    app.add_handler(TypeHandler(Update, on_end), group=1000)
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    try:
+        workload = [Update.de_json(data, app.bot) for data in build_workload(bot, args.mix, args.users, args.updates)]
+        expected = len(workload)
+        db_before = bot.storage.db_seconds
+        interval = 1 / args.rate if args.rate else 0
+        t0 = time.perf_counter()
+        for update in workload:
+            queued[update.update_id] = time.perf_counter()
+            await app.update_queue.put(update)
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.wait_for(done.wait(), args.timeout)
+        elapsed = time.perf_counter() - t0
+        await bot.storage.buffer.flush()
+        db_seconds = bot.storage.db_seconds - db_before
+    finally:
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        await app.post_shutdown(app)
+
+    return {
+        "updates": expected,
+        "users": args.users,
+        "mix": ",".join(f"{k}={v}" for k, v in args.mix.items()),
+        "shards": args.shards,
+        "api_latency_ms": args.api_latency_ms,
+        "flush_ms": int(os.environ["DB_FLUSH_MS"]),
+        "throughput": round(expected / elapsed, 1),
+        "handler_p50_ms": round(percentile(handler_ms, 50), 2),
+        "handler_p95_ms": round(percentile(handler_ms, 95), 2),
+        "handler_p99_ms": round(percentile(handler_ms, 99), 2),
+        "e2e_p50_ms": round(percentile(total_ms, 50), 2),
+        "e2e_p95_ms": round(percentile(total_ms, 95), 2),
+        "e2e_p99_ms": round(percentile(total_ms, 99), 2),
+        "db_ms_per_update": round(db_seconds * 1000 / expected, 3),
+        "api_calls": sum(api.calls.values()),
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"سيناريو غير معروف: {name} (المتاح: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("menu=3,faq=3,booking=2,inquiry=1,admin=1"))
+    parser.add_argument("--shards", type=int, default=8, help="عدد أجزاء المعالجة، 0 للمعالجة المتسلسلة")
+    parser.add_argument("--max-pending", type=int, default=4096)
+    parser.add_argument("--rate", type=float, default=0, help="تحديث في الثانية، 0 لإرسال الكل دفعة واحدة")
+    parser.add_argument("--api-latency-ms", type=float, default=0)
+    parser.add_argument("--flush-ms", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="إلحاق النتيجة كسطر JSON بهذا الملف")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    tmp = tempfile.mkdtemp(prefix="clinic-bench-")
+    # الإعدادات تُقرأ عند استيراد bot، فتُضبط قبله
+    os.environ.update({
+        "BOT_TOKEN": f"{BOT_ID}:BENCH",
+        "ADMIN_ID": str(BENCH_ADMIN_ID),
+        "DB_PATH": os.path.join(tmp, "bench.db"),
+        "DB_FLUSH_MS": str(args.flush_ms),
+        "SLOT_CAPACITY": str(args.updates),
+        "METRICS_PORT": "0",
+    })
+    result = asyncio.run(run(args))
+    width = max(map(len, result))
+    for key, value in result.items():
+        print(f"{key:<{width}}  {value}")
+    if args.json:
+        with open(args.json, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
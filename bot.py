@@ -3,15 +3,32 @@
 import os
 import logging
 import asyncio
-import sqlite3
+import tempfile
 from datetime import datetime, timedelta
+from time import monotonic, sleep
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler,
-    CallbackQueryHandler, filters, ContextTypes
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler,
+    CallbackQueryHandler, TypeHandler, filters, ContextTypes
 )
 from dotenv import load_dotenv
 
+import metrics
+from content import ContentStore
+from media import MediaStore, media_from_message
+from notifier import AdminNotifier
+from retention import EXPORT_FORMATS, RetentionJob, write_export
+from router import CallbackRouter, require_admin, timed, track_last_seen
+from scheduler import Broadcasts, Scheduler, Sender
+from search import match_query
+from sharding import ShardedUpdateProcessor
+from slots import SlotEngine, time_from_key, time_key
+from state import UserState
+from storage import Storage
+from triage import Triage
+import webhook
+
 # ==================== الإعداد ====================
 load_dotenv()
 
@@ -22,385 +39,406 @@ try:
     ADMIN_ID = int(ADMIN_ID_STR) if ADMIN_ID_STR and ADMIN_ID_STR.isdigit() else 0
 except (ValueError, AttributeError):
     ADMIN_ID = 0
-DB_PATH = "clinic.db"
+DB_PATH = os.getenv('DB_PATH', 'clinic.db')
+# نصوص القوائم والأسئلة المتكررة؛ تُعاد قراءتها تلقائياً عند تعديل الملف
+CONTENT_PATH = os.getenv('CONTENT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content.json'))
+# ذاكرة حالات المستخدمين: أقصى عدد ومدة الخمول قبل الطرد (بالثواني)
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', '10000'))
+STATE_CACHE_TTL = int(os.getenv('STATE_CACHE_TTL', '1800'))
+# الكتابة المؤجلة لسجل الرسائل: تفريغ كل DB_FLUSH_MS ميلي ثانية أو عند تجمع DB_FLUSH_ROWS صف
+DB_FLUSH_MS = int(os.getenv('DB_FLUSH_MS', '200'))
+DB_FLUSH_ROWS = int(os.getenv('DB_FLUSH_ROWS', '100'))
+# إشعارات الأدمن: رسالة في الثانية كحد أقصى، ودمجها في ملخص عند تراكم ADMIN_DIGEST_THRESHOLD إشعار
+ADMIN_NOTIFY_RATE = float(os.getenv('ADMIN_NOTIFY_RATE', '1'))
+ADMIN_DIGEST_THRESHOLD = int(os.getenv('ADMIN_DIGEST_THRESHOLD', '5'))
+# أقصى انتظار لإرسال ما تبقى من إشعارات الأدمن عند الإيقاف (انقطاع الشبكة لا يعلّق الإيقاف)
+ADMIN_NOTIFY_DRAIN_SECONDS = float(os.getenv('ADMIN_NOTIFY_DRAIN_SECONDS', '15'))
+# مواعيد الحجز: الأوقات اليومية، أيام العمل (0 = الاثنين ... 6 = الأحد)، سعة كل موعد،
+# عدد الأيام المعروضة مقدماً، ومدة الحجز المؤقت أثناء إدخال الاسم والهاتف
+SLOT_TIMES = {"13:00": "1 ظهراً", "15:00": "3 عصراً", "17:00": "5 عصراً"}
+SLOT_WORKING_DAYS = (6, 0, 1, 2, 3)
+SLOT_CAPACITY = int(os.getenv('SLOT_CAPACITY', '3'))
+SLOT_HORIZON_DAYS = int(os.getenv('SLOT_HORIZON_DAYS', '7'))
+SLOT_HOLD_MINUTES = int(os.getenv('SLOT_HOLD_MINUTES', '10'))
+# طريقة استقبال التحديثات: polling (الافتراضي) أو webhook عبر خادم HTTP محلي خلف الوكيل العكسي
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # العنوان العام المسجل لدى Telegram، يُترك فارغاً إن سُجل مسبقاً
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# التوازي: عدد الأجزاء التي تُوزَّع عليها التحديثات حسب المستخدم (تحديثات المستخدم الواحد دائماً بالترتيب)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '1024'))
+# المراقبة: عمليات قاعدة البيانات الأبطأ من DB_SLOW_MS تُسجَّل، والمقاييس تُعرض على METRICS_PORT (0 لتعطيلها)
+DB_SLOW_MS = int(os.getenv('DB_SLOW_MS', '100'))
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# الاحتفاظ: الرسائل والحجوزات الأقدم من عدد الأيام تُنقل إلى ملفات مضغوطة في ARCHIVE_DIR (0 = بلا حد)،
+# والدردشة العامة غير المصنفة تُؤرشف أبكر. تعمل الأرشفة كل RETENTION_INTERVAL_HOURS ساعة
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+RETENTION_MESSAGES_DAYS = int(os.getenv('RETENTION_MESSAGES_DAYS', '180'))
+RETENTION_GENERAL_DAYS = int(os.getenv('RETENTION_GENERAL_DAYS', '30'))
+RETENTION_BOOKINGS_DAYS = int(os.getenv('RETENTION_BOOKINGS_DAYS', '365'))
+# الرد على إشعار أقدم من RETENTION_LINKS_DAYS يوم لا يصل لصاحبه (يبقى /reply رقم_الطلب)
+RETENTION_LINKS_DAYS = int(os.getenv('RETENTION_LINKS_DAYS', '30'))
+RETENTION_INTERVAL_HOURS = float(os.getenv('RETENTION_INTERVAL_HOURS', '24'))
+# الصور والملفات تُرسل للأدمن بمعرّفها في Telegram دائماً، وتُنزَّل أيضاً إلى MEDIA_DIR إن حُدد
+MEDIA_DIR = os.getenv('MEDIA_DIR')
+# مهلة الرد على الطلبات (رسالة الترحيب تعد بـ 24-48 ساعة): تنبيه الأدمن عند SLA_WARN_HOURS ثم عند SLA_HOURS
+SLA_HOURS = float(os.getenv('SLA_HOURS', '48'))
+SLA_WARN_HOURS = float(os.getenv('SLA_WARN_HOURS', '36'))
+SLA_CHECK_MINUTES = float(os.getenv('SLA_CHECK_MINUTES', '15'))
+# التذكير بالموعد قبله بعدد الساعات هذه، والبث الجماعي بـ BROADCAST_RATE رسالة في الثانية
+# (حد Telegram نحو 30 لكل البوت، والباقي لردود المعالجات). المهام المستحقة تُفحص كل SCHEDULER_POLL_SECONDS
+REMINDER_HOURS = [float(h) for h in os.getenv('REMINDER_HOURS', '24,2').split(',') if h.strip()]
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '20'))
+SCHEDULER_POLL_SECONDS = float(os.getenv('SCHEDULER_POLL_SECONDS', '30'))
+# إعادة التشغيل بعد الأعطال: انتظار يبدأ من RESTART_MIN_SECONDS ويتضاعف حتى RESTART_MAX_SECONDS،
+# ويعود للبداية إن عمل البوت RESTART_RESET_SECONDS ثانية قبل أن يتعطل
+RESTART_MIN_SECONDS = float(os.getenv('RESTART_MIN_SECONDS', '1'))
+RESTART_MAX_SECONDS = float(os.getenv('RESTART_MAX_SECONDS', '300'))
+RESTART_RESET_SECONDS = float(os.getenv('RESTART_RESET_SECONDS', '600'))
 
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+# httpx يسجل كل طلب برابطه في INFO، وروابط Bot API وتنزيل الملفات تحمل التوكن
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # ==================== قاعدة البيانات ====================
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        state TEXT,
-        last_message TIMESTAMP
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS bookings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        name TEXT,
-        phone TEXT,
-        date TEXT,
-        time TEXT,
-        created_at TIMESTAMP
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        username TEXT,
-        message_text TEXT,
-        message_type TEXT,
-        created_at TIMESTAMP
-    )''')
-    conn.commit()
-    conn.close()
-
-def db_execute(query, params=(), fetch=False):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(query, params)
-    result = c.fetchall() if fetch else None
-    conn.commit()
-    conn.close()
-    return result
-
-
-# ==================== وظائف مساعدة ====================
-def set_user_state(user_id, state):
-    db_execute("INSERT OR REPLACE INTO users (user_id, state, last_message) VALUES (?, ?, ?)",
-               (user_id, state, datetime.now()))
-
-def get_user_state(user_id):
-    res = db_execute("SELECT state FROM users WHERE user_id=?", (user_id,), fetch=True)
-    return res[0][0] if res else None
-
-def clear_user_state(user_id):
-    db_execute("UPDATE users SET state=NULL WHERE user_id=?", (user_id,))
-
-def update_last_message(user_id):
-    db_execute("UPDATE users SET last_message=? WHERE user_id=?", (datetime.now(), user_id))
-
-def save_booking(user_id, name, phone, date, time):
-    db_execute(
-        "INSERT INTO bookings (user_id, name, phone, date, time, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (user_id, name, phone, date, time, datetime.now())
-    )
-
-def save_message(user_id, username, message_text, message_type):
-    """حفظ الرسالة في قاعدة البيانات"""
-    db_execute(
-        "INSERT INTO messages (user_id, username, message_text, message_type, created_at) VALUES (?, ?, ?, ?, ?)",
-        (user_id, username, message_text, message_type, datetime.now())
-    )
+storage = Storage(DB_PATH, flush_ms=DB_FLUSH_MS, flush_rows=DB_FLUSH_ROWS,
+                  cache_size=STATE_CACHE_SIZE, cache_ttl=STATE_CACHE_TTL, slow_ms=DB_SLOW_MS)
+
+# ==================== مكونات البوت ====================
+# كل إشعار مرسل عن مستخدم يُربط بصاحبه، فرد الأدمن عليه يصل للمستخدم مباشرة
+notifier = AdminNotifier(ADMIN_ID, rate=ADMIN_NOTIFY_RATE, digest_threshold=ADMIN_DIGEST_THRESHOLD,
+                         drain_timeout=ADMIN_NOTIFY_DRAIN_SECONDS,
+                         on_sent=lambda message_id, link: triage.link(message_id, *link))
+triage = Triage(storage, notifier, sla_hours=SLA_HOURS, warn_hours=SLA_WARN_HOURS,
+                check_interval=SLA_CHECK_MINUTES * 60)
+router = CallbackRouter(middleware=[timed()])
+# النصوص ولوحات الأزرار التي تطلبها المعالجات بالاسم
+content = ContentStore(
+    CONTENT_PATH,
+    required_texts=("welcome", "main_menu", "faq_menu", "faq_missing", "ask", "edit_diet", "explain_analysis",
+                    "medical_diet", "daily_followup", "contact"),
+    required_keyboards=("welcome", "main_menu", "faq_answer"),
+)
+slots = SlotEngine(storage, SLOT_TIMES, SLOT_WORKING_DAYS, capacity=SLOT_CAPACITY,
+                   horizon_days=SLOT_HORIZON_DAYS, hold_minutes=SLOT_HOLD_MINUTES)
+metrics_server = metrics.MetricsServer()
+media_store = MediaStore(storage, MEDIA_DIR)
+retention = RetentionJob(storage, ARCHIVE_DIR, messages_days=RETENTION_MESSAGES_DAYS,
+                         general_days=RETENTION_GENERAL_DAYS, bookings_days=RETENTION_BOOKINGS_DAYS,
+                         links_days=RETENTION_LINKS_DAYS,
+                         interval=RETENTION_INTERVAL_HOURS * 3600)
+sender = Sender(storage, rate=BROADCAST_RATE)
+scheduler = Scheduler(storage, poll_interval=SCHEDULER_POLL_SECONDS)
+broadcasts = Broadcasts(storage, scheduler, sender, notifier)
+
+# زمن بدء التشغيل: الثواني من بدء المحاولة (startup["at"]) حتى اكتمال post_init (ready)
+# وحتى وصول أول تحديث للمعالجات (first_update)
+startup = {"at": monotonic()}
+startup_seconds = {}
+
+def register_gauges(app: Application):
+    """أحجام الطوابير تُقرأ لحظة الطلب من /metrics، فلا كلفة لها على مسار المعالجة"""
+    registry = metrics.registry
+    registry.gauge("bot_update_queue_size", "تحديثات مستلمة لم تبدأ معالجتها", app.update_queue.qsize)
+    registry.gauge("bot_notifier_queue_size", "إشعارات أدمن بانتظار الإرسال", notifier.queue.qsize)
+    registry.gauge("bot_media_queue_size", "ملفات بانتظار التنزيل إلى MEDIA_DIR", media_store.queue.qsize)
+    registry.gauge("bot_write_buffer_rows", "صفوف الكتابة المؤجلة بانتظار التفريغ", lambda: len(storage.buffer))
+    registry.gauge("bot_state_cache_size", "حالات المستخدمين في الذاكرة", lambda: len(storage.states))
+    registry.gauge("bot_scheduler_running_jobs", "مهام مجدولة قيد التنفيذ", lambda: len(scheduler._running))
+    registry.gauge("bot_startup_seconds", "زمن بدء التشغيل حسب المرحلة", lambda: dict(startup_seconds), ["phase"])
+    processor = app.update_processor
+    if isinstance(processor, ShardedUpdateProcessor):
+        registry.gauge("bot_shard_queue_size", "عمق طابور كل جزء معالجة",
+                       lambda: {str(i): depth for i, depth in enumerate(processor.depths())}, ["shard"])
+
+async def on_startup(app: Application):
+    try:
+        await storage.open()
+        notifier.start(app.bot)
+        content.start()
+        await slots.start()
+        retention.start()
+        media_store.start(app.bot)
+        triage.start()
+        sender.start(app.bot)
+        scheduler.start()
+        register_gauges(app)
+        if METRICS_PORT:
+            await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+    except BaseException:
+        # post_stop لا يُستدعى إن فشل post_init، والمحاولة التالية في main تبدأ من مكونات متوقفة
+        await on_stop(app)
+        raise
+    startup_seconds["ready"] = monotonic() - startup["at"]
+    logger.info(f"⏱️ البوت جاهز خلال {startup_seconds['ready'] * 1000:.0f} ms")
+
+async def on_stop(app: Application):
+    # تفريغ طابور إشعارات الأدمن قبل إغلاق اتصال البوت؛ البث المقطوع يُستأنف عند التشغيل التالي
+    await scheduler.stop()
+    await triage.stop()
+    await notifier.stop()
+    await content.stop()
+    await slots.stop()
+    await retention.stop()
+    await media_store.stop()
+
+async def on_shutdown(app: Application):
+    # post_stop لا يُستدعى إن فشل التشغيل بعد post_init (المنفذ مشغول، set_webhook، بدء الاستقبال)،
+    # فتُوقف المكونات هنا قبل غلق القاعدة حتى لا تبقى حلقاتها تعمل في المحاولة التالية؛ كل stop() آمن للتكرار
+    await on_stop(app)
+    await metrics_server.stop()
+    await storage.close()
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """كل استثناء لم يُعالج (من المعالجات أو من الاستقبال) يُعدّ ويُسجل مع تتبعه"""
+    error = context.error
+    metrics.ERRORS.inc(type(error).__name__)
+    logger.error(f"❌ خطأ أثناء معالجة التحديث: {error}", exc_info=error)
+
+# ==================== التحديثات المكررة ====================
+async def skip_duplicate_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أول ما يمر به كل تحديث: ما عولج قبل إعادة التشغيل ثم أعاد Telegram إرساله يتوقف هنا"""
+    if "first_update" not in startup_seconds:
+        startup_seconds["first_update"] = monotonic() - startup["at"]
+        logger.info(f"⏱️ أول تحديث بعد {startup_seconds['first_update'] * 1000:.0f} ms من بدء التشغيل")
+    if not storage.claim_update(update.update_id):
+        metrics.DUPLICATE_UPDATES.inc()
+        logger.info(f"♻️ تجاهل التحديث {update.update_id}: عولج مسبقاً")
+        raise ApplicationHandlerStop
+
+async def complete_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # بعد المعالجات (حتى إن فشل أحدها) فلا يُعاد تحديث فاشل بلا نهاية
+    storage.complete_update(update.update_id)
 
 # ==================== رسالة الترحيب ====================
-def get_welcome_message():
-    """رسالة الترحيب الطويلة"""
-    return """مرحبًا بيك في بوت الاستفسارات الخاص بعيادة B Healthy 🌿
-
-هنا نسمعك، ونتابع وياك… لأن إحنا نؤمن إن كل تغيير كبير يبدأ بخطوة وعي صغيرة.
-
-🔸 البوت هذا مصمَّم للإجابة على استفساراتك الغذائية والعلاجية المتعلقة بحالتك الصحية، وتشمل:
-
-– أسئلتك عن النظام الغذائي الخاص بيك
-
-– تطوّر الأعراض أو التحسّن اللي تحس بيه
-
-– أي توجيه تحتاجه ضمن الخطة العلاجية اللي تتبعها ويانا
-
-❗️إذا ده تعاني من أعراض جديدة أو حالة مرضية جديدة، ضروري تراجع الطبيب مباشرة، لأن التشخيص الطبي ما يتم عن طريق الرسائل.
-
-📌 نحب نوضح إن البوت مو بديل عن الزيارة الطبية، لكنه موجود حتى يدعمك، ويتابع وياك، ويخلي عندك إحساس إنك مو وحدك بالطريق.
-
-🕒 تقدر تتواصل ويانا بأي وقت، البوت متاح 24/7 لخدمتك، وبإمكانك ترك سؤالك، وترد عليك اخصائية التغذية بأقرب وقت ممكن خلال 24-48 ساعة.
-
-🫶 احنه نؤمن:
-
-جسمك يستحق الدعم، وأنت تستحق تتحرر من الألم.
-
-خلينا نكون جزء من رحلة تعافيك، خطوة بخطوة"""
-
 async def show_welcome_message(context, chat_id):
     """عرض رسالة الترحيب"""
-    welcome_msg = get_welcome_message()
-    keyboard = [
-        [InlineKeyboardButton("➡️ ابدأ", callback_data="show_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(chat_id=chat_id, text=welcome_msg, reply_markup=reply_markup)
+    await context.bot.send_message(chat_id=chat_id, text=content.text("welcome"), reply_markup=content.keyboard("welcome"))
 
 # ==================== أوامر المستخدم ====================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    set_user_state(user.id, None)
+    await storage.set_user_state(user.id, None, user.username)
+    await slots.release(user.id)
+    await sender.unblock(user.id)
     
     # إرسال رسالة الترحيب أولاً (ثابتة)
     await show_welcome_message(context, update.effective_chat.id)
 
 async def show_main_menu(context, chat_id, message_id=None):
-    message = "🤔 شنو تحب تسوي اليوم؟\n\nاختر من الخيارات التالية:"
-    keyboard = [
-        [InlineKeyboardButton("1️⃣ 💰 استفسار جديد", callback_data="ask")],
-        [InlineKeyboardButton("2️⃣ 💰 أريد أعدل نظامي", callback_data="edit_diet")],
-        [InlineKeyboardButton("3️⃣ 💰 شرح تحليل", callback_data="explain_analysis")],
-        [InlineKeyboardButton("4️⃣ 💰 أريد أحجز موعد مراجعة", callback_data="book")],
-        [InlineKeyboardButton("5️⃣ 💰 أريد برنامج غذائي لحالة طبية معينة", callback_data="medical_diet")],
-        [InlineKeyboardButton("6️⃣ 💰 أحتاج متابعة يومية مع أخصائية التغذية", callback_data="daily_followup")],
-        [InlineKeyboardButton("7️⃣ 💰 أريد التواصل مع الأخصائية مباشرة", callback_data="contact")],
-        [InlineKeyboardButton("❓ الأسئلة المتكررة", callback_data="faq")],
-        [InlineKeyboardButton("🏠 الصفحة الرئيسية", callback_data="show_welcome")]
-    ]
-    reply = InlineKeyboardMarkup(keyboard)
+    message = content.text("main_menu")
+    reply = content.keyboard("main_menu")
     if message_id:
         await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=message, reply_markup=reply)
     else:
         await context.bot.send_message(chat_id=chat_id, text=message, reply_markup=reply)
 
 # ==================== خيارات المستخدم ====================
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    data = query.data
-    update_last_message(user_id)
-
-    if data == "book":
-        await show_booking_days(query, context)
-    elif data.startswith("day_"):
-        await show_booking_times(query, context, data.split("_")[1])
-    elif data.startswith("time_"):
-        date, time = data.split("_")[1], data.split("_")[2]
-        await confirm_booking(query, context, date, time)
-    elif data == "ask":
-        await query.edit_message_text("📝 اكتب سؤالك وسنرد خلال 24 ساعة.")
-        set_user_state(user_id, "waiting_inquiry")
-    elif data == "edit_diet":
-        message_text = """🔄 تعديل النظام الغذائي
-
-اذكر شنو المشاكل أو الأعراض اللي تمر بيها أو الأكلات اللي عندك مشكلة فيها.
-
-حتى نساعدك بالتعديل المناسب."""
-        await query.edit_message_text(message_text)
-        set_user_state(user_id, "waiting_diet_edit")
-    elif data == "explain_analysis":
-        await query.edit_message_text("🔬 أرسل صورة أو تفاصيل التحليل الذي تريد شرحه، وسنقوم بشرحه لك.")
-        set_user_state(user_id, "waiting_analysis")
-    elif data == "medical_diet":
-        await query.edit_message_text("🏥 أرسل تفاصيل الحالة الطبية والبرنامج الغذائي المطلوب:")
-        set_user_state(user_id, "waiting_medical_diet")
-    elif data == "daily_followup":
-        await query.edit_message_text("📆 أرسل تفاصيل حالتك الصحية والهدف من المتابعة اليومية:")
-        set_user_state(user_id, "waiting_daily_followup")
-    elif data == "contact":
-        await query.edit_message_text("📞 تواصل معنا عبر واتساب: 07727292075")
-    elif data == "show_menu":
-        # الانتقال من رسالة الترحيب إلى القائمة
-        await show_main_menu(context, query.message.chat.id, query.message.message_id)
-    elif data == "show_welcome":
-        # العودة إلى رسالة الترحيب من القائمة
-        welcome_msg = get_welcome_message()
-        keyboard = [
-            [InlineKeyboardButton("➡️ ابدأ", callback_data="show_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text=welcome_msg, reply_markup=reply_markup)
-    elif data == "faq":
-        await show_faq_menu(query, context)
-    elif data.startswith("faq_"):
-        await show_faq_answer(query, context, data.split("_")[1])
-    elif data == "back_menu":
-        await show_main_menu(context, query.message.chat.id, query.message.message_id)
-
-
-# ==================== الأسئلة المتكررة ====================
-async def show_faq_menu(query, context):
-    """عرض قائمة الأسئلة المتكررة"""
-    message = "❓ الأسئلة المتكررة\n\nاختر السؤال اللي تريد تعرف إجابته:"
-    keyboard = [
-        [InlineKeyboardButton("🔸 زيادة الأعراض بعد العلاج المضاد للبكتيريا/الفطريات", callback_data="faq_1")],
-        [InlineKeyboardButton("🔸 زيادة الأعراض بعد البروبيوتيك", callback_data="faq_2")],
-        [InlineKeyboardButton("🔸 المتابعة الأسبوعية في العيادة", callback_data="faq_3")],
-        [InlineKeyboardButton("🔸 مراجعة العلاجات", callback_data="faq_4")],
-        [InlineKeyboardButton("🔙 رجوع", callback_data="back_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(text=message, reply_markup=reply_markup)
-
-async def show_faq_answer(query, context, faq_id):
-    """عرض إجابة السؤال المختار"""
-    answers = {
-        "1": """🔸 زيادة الأعراض بعد العلاج المضاد للبكتيريا/الفطريات
-
-ج/ عند بدء استخدام علاج مضاد للبكتيريا أو الفطريات، من الطبيعي نلاحظ زيادة مؤقتة في الأعراض.
-
-هذا لأن البكتيريا والفطريات هي كائنات دقيقة مغلّفة مثل الفقاعة، تحتوي بداخلها على بروتينات وسموم.
-
-لما نبدأ العلاج، هاي الكائنات تموت وتتحلل، وتفرز محتواها داخل الجسم – وهذا الشي يسبب ما نسمّيه علميًا "die-off reaction" أو تفاعل تحلل الكائنات الممرضة.
-
-هذا التفاعل ممكن يسبب أعراض مثل التعب، الانتفاخ، أو زيادة بسيطة بالأعراض السابقة، لكنه علامة إيجابية تدل على استجابة الجسم للعلاج.
-
-غالبًا تستقر الأعراض خلال ٣ أيام إلى أسبوع كحد أقصى.
-
-ولتقليل الانزعاج، يُنصح بدعم الجسم بمضادات أكسدة طبيعية مثل:
-
-• شاي الكركم مع الليمون 🍋
-• أو الشاي الأخضر ☕
+# الأزرار التي تمثل طلباً فعلياً تسجل آخر ظهور، أما التنقل بين القوائم فلا يكتب شيئاً
+tracked = [track_last_seen(storage)]
 
-لأنها تساعد الجسم على التخلص من السموم بشكل أسرع. 
+async def ask_for(query, text_name, step):
+    """عرض نص الطلب وانتظار رد المستخدم في الخطوة step"""
+    await query.edit_message_text(content.text(text_name))
+    await storage.set_user_state(query.from_user.id, UserState(step))
 
-ولا تنسى تغذي جسمك بالمغذيات المكتوبه بنظامك الغذائي (ماء كسور البقر، شوربة الخضار) اللحوم الحمراء والبيضاء والدهون الصحية""",
-        
-        "2": """🔸 زيادة الأعراض بعد البروبيوتيك
+@router.route("ask", middleware=tracked)
+async def ask_inquiry(query, context):
+    await ask_for(query, "ask", "waiting_inquiry")
 
-ج/ أفهم تمامًا شنو تحس، وصدقني، مو غريب أبدًا اللي ديصير وياك.
+@router.route("edit_diet", middleware=tracked)
+async def ask_diet_edit(query, context):
+    await ask_for(query, "edit_diet", "waiting_diet_edit")
 
-بالعكس، اللي تمر بيه الآن ممكن يكون علامة إن الجسم دا يتغير للأفضل، حتى لو بدا الأمر مُتعب بالبداية.
+@router.route("explain_analysis", middleware=tracked)
+async def ask_analysis(query, context):
+    await ask_for(query, "explain_analysis", "waiting_analysis")
 
-لما تبدي تاخذ البروبيوتيك، الجسم يدخل بمرحلة تأقلم داخل الأمعاء…
+@router.route("medical_diet", middleware=tracked)
+async def ask_medical_diet(query, context):
+    await ask_for(query, "medical_diet", "waiting_medical_diet")
 
-كأنما دا يعيد ترتيب داخلي شامل: البكتيريا المفيدة تبدي تطغى على الضارة، وبهالعملية تطلع سموم مؤقتة بسبب موت البكتيريا الضارة.
+@router.route("daily_followup", middleware=tracked)
+async def ask_daily_followup(query, context):
+    await ask_for(query, "daily_followup", "waiting_daily_followup")
 
-وهالشي ممكن يسبب:
+@router.route("contact", middleware=tracked)
+async def show_contact(query, context):
+    await query.edit_message_text(content.text("contact"))
 
-• نفخة
-• غازات
-• تغيّرات بالإخراج
-• تعب عام مفاجئ
+@router.route("show_menu")
+@router.route("back_menu")
+async def back_to_menu(query, context):
+    # الانتقال من رسالة الترحيب (أو من قائمة فرعية) إلى القائمة
+    await show_main_menu(context, query.message.chat.id, query.message.message_id)
 
-وهاي الحالة نسميها أحيانًا "probiotic adjustment reaction"، وهي حالة مؤقتة، ويدل إن جسمك قاعد يتفاعل ويتأقلم.
+@router.route("show_welcome")
+async def back_to_welcome(query, context):
+    # العودة إلى رسالة الترحيب من القائمة
+    await query.edit_message_text(text=content.text("welcome"), reply_markup=content.keyboard("welcome"))
 
-🥄 حتى تساعد نفسك بهالفترة:
 
-• خفّف على نفسك، خذ الأمور بهدوء
-• اشرب سوائل دافئة مثل النعناع، الزنجبيل أو الشاي الأخضر
-• وكمّل البروبيوتيك بجرعة منتظمة
-
-غالبًا، هاي الأعراض تخف خلال ٣ إلى ٧ أيام
-
-🛑 وإذا كانت التقلصات قوية جدًا، أو التعب فوق طاقتك، لا بأس أبدًا إن توقف البروبيوتيك مؤقتًا وترجع له بعد أسبوع.
-
-الراحة جزء من الخطة، وماكو شيء أغلى من راحة بالك وجسمك.
-
-🫶 إنت مو وحدك بهالرحلة، إحنا ويّاك، خطوة بخطوة، حتى نوصل لتحسن حقيقي ومستدام.""",
-        
-        "3": """🔸 المتابعة الأسبوعية في العيادة
-
-إحنا جدًا فخورين بجهودك واهتمامك بصحتك 🌿
-
-الالتزام بالمتابعة هو خطوة قوية تعكس وعيك، ويخلينا نكون شركاء حقيقيين وياك برحلة العلاج.
-
-نعم، من المهم جدًا الالتزام بالمراجعة الأسبوعية داخل العيادة، لأن المتابعة تُعتبر جزء أساسي من خطة العلاج.
-
-كل زيارة نتابع بيها استجابة الجسم للنظام الغذائي، نقيّم التحسّن، نعدّل الجرعات أو نوعية الأطعمة حسب تطور الحالة، ونحل أي مشكلة تظهر حتى نستمر بالتقدم.
-
-📍 أما إذا كان الحضور الأسبوعي صعب — سواء بسبب السفر أو البعد أو ظروف خاصة — نطلب الالتزام بالمتابعة عن طريق تليجرام بشكل منتظم، مع الحضور لمراجعة شهرية داخل العيادة.
-
-المراجعة الشهرية ضرورية وبيها متابعة الطبيب واخصائية التغذية حتى نقدر نحدث الخطة الغذائية أو العلاجية حسب الحاجة.
-
-📌 موعد مراجعتك مكتوب بوضوح داخل البرنامج الغذائي، يرجى الالتزام به والتواصل ويانا لتأكيد الحجز""",
-        
-        "4": """🔸 مراجعة العلاجات
-
-ج/ شكرًا لإرسال صور علاجاتك، راح نراجعها بأقرب وقت ونتواصل وياك.
-
-اذا تأخرنا عليك بالرد لا تتردد واتصل بينا او راسلنا على واتس اب العيادة 07727292075 🌱
+# ==================== الأسئلة المتكررة ====================
+@router.route("faq")
+async def show_faq_menu(query, context):
+    """عرض قائمة الأسئلة المتكررة"""
+    await query.edit_message_text(text=content.text("faq_menu"), reply_markup=content.catalog.faq_menu)
 
-عندك العافية💕🪴"""
-    }
-    
-    answer = answers.get(faq_id, "عذراً، السؤال غير موجود.")
-    keyboard = [
-        [InlineKeyboardButton("🔙 رجوع للأسئلة", callback_data="faq")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(text=answer, reply_markup=reply_markup)
+@router.route("faq", prefix=True)
+async def show_faq_answer(query, context, faq_id):
+    """عرض إجابة السؤال المختار"""
+    catalog = content.catalog
+    answer = catalog.faq_answers.get(faq_id, catalog.texts["faq_missing"])
+    await query.edit_message_text(text=answer, reply_markup=catalog.keyboards["faq_answer"])
 
 
 # ========== خطوات الحجز ==========
+@router.route("book", middleware=tracked)
 async def show_booking_days(query, context):
-    days = ["الأحد", "الاثنين", "الثلاثاء", "الأربعاء", "الخميس"]
-    keyboard = [[InlineKeyboardButton(d, callback_data=f"day_{d}")] for d in days]
+    # الأيام والأوقات تُقرأ من ذاكرة المتاح في SlotEngine دون أي استعلام
+    days = slots.days()
+    keyboard = [[InlineKeyboardButton(slots.day_label(d), callback_data=f"day:{d}")] for d in days]
     keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="back_menu")])
-    await query.edit_message_text("📅 اختر اليوم المناسب:", reply_markup=InlineKeyboardMarkup(keyboard))
+    text = "📅 اختر اليوم المناسب:" if days else "😔 لا توجد مواعيد متاحة حالياً، حاول لاحقاً."
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def show_booking_times(query, context, date):
-    times = ["1 ظهراً", "3 عصراً", "5 عصراً"]
-    keyboard = [[InlineKeyboardButton(t, callback_data=f"time_{date}_{t}")] for t in times]
+@router.route("day", prefix=True, middleware=tracked)
+async def show_booking_times(query, context, date, notice=""):
+    times = slots.slots(date)
+    keyboard = [
+        [InlineKeyboardButton(slots.time_label(t), callback_data=f"time:{date}:{time_key(t)}")]
+        for t, _ in times
+    ]
     keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="book")])
-    await query.edit_message_text(f"⏰ اختر الوقت ليوم {date}:", reply_markup=InlineKeyboardMarkup(keyboard))
+    text = f"⏰ اختر الوقت ليوم {slots.day_label(date)}:" if times else f"😔 لا توجد أوقات متاحة ليوم {slots.day_label(date)}."
+    await query.edit_message_text(notice + text, reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def confirm_booking(query, context, date, time):
+@router.route("time", prefix=True, middleware=tracked)
+async def confirm_booking(query, context, date, key):
     user_id = query.from_user.id
-    await query.edit_message_text("🧾 أرسل اسمك الثلاثي:")
-    set_user_state(user_id, f"waiting_name_{date}_{time}")
+    time = time_from_key(key)
+    if not await slots.hold(user_id, date, time):
+        await show_booking_times(query, context, date, notice="⚠️ عذراً، هذا الموعد لم يعد متاحاً.\n\n")
+        return
+    await query.edit_message_text(f"🧾 أرسل اسمك الثلاثي:\n(الموعد محجوز لك مؤقتاً لمدة {SLOT_HOLD_MINUTES} دقائق)")
+    await storage.set_user_state(user_id, UserState("waiting_name", {"date": date, "time": time}))
+
+# ========== تذكير المواعيد ==========
+async def schedule_reminders(booking_id, date, time):
+    """مهمة تذكير لكل عدد ساعات في REMINDER_HOURS، ما لم يكن وقتها قد فات"""
+    appointment = datetime.fromisoformat(f"{date} {time}")
+    now = datetime.now()
+    for hours in REMINDER_HOURS:
+        run_at = appointment - timedelta(hours=hours)
+        if run_at > now:
+            await scheduler.schedule("reminder", run_at, {"booking_id": booking_id, "hours": hours})
+
+@scheduler.job("reminder")
+async def send_reminder(payload):
+    # الحجز يُقرأ وقت التذكير: إن حُذف أو أُرشف فلا تذكير
+    res = await storage.execute(
+        "SELECT user_id, name, date, time FROM bookings WHERE id=?", (payload["booking_id"],), fetch=True
+    )
+    if not res:
+        return
+    user_id, name, date, time = res[0]
+    hours = payload["hours"]
+    when = "غداً" if hours >= 24 else f"بعد {hours:g} ساعة"
+    await sender.send(user_id, f"⏰ تذكير: موعدك في عيادة Be Healthy {when}، يوم {slots.day_label(date)} "
+                               f"الساعة {slots.time_label(time)}.\nننتظرك {name} 💚")
 
 # ==================== استقبال الرسائل ====================
+# نوع الرسالة المحفوظة حسب حالة المستخدم
+MESSAGE_TYPES = {
+    "waiting_inquiry": "inquiry",
+    "waiting_diet_edit": "diet_edit",
+    "waiting_analysis": "analysis",
+    "waiting_medical_diet": "medical_diet",
+    "waiting_daily_followup": "daily_followup",
+}
+
+# لكل طلب مصنف: الرد على المستخدم وعنوان إشعار الأدمن
+REQUEST_REPLIES = {
+    "waiting_inquiry": ("🙏 تم استلام استفسارك، سنرد بأقرب وقت.", "📝 استفسار جديد"),
+    "waiting_diet_edit": ("✅ تم استلام طلب تعديل النظام الغذائي، سنقوم بمراجعته وإرسال النظام المحدث.", "🔄 طلب تعديل نظام غذائي"),
+    "waiting_analysis": ("✅ تم استلام التحليل، سنقوم بشرحه وإرسال التفسير.", "🔬 طلب شرح تحليل"),
+    "waiting_medical_diet": ("✅ تم استلام طلب البرنامج الغذائي الطبي، سنقوم بإعداده وإرساله.", "🏥 طلب برنامج غذائي طبي"),
+    "waiting_daily_followup": ("✅ تم استلام طلب المتابعة اليومية، سنقوم بترتيب جدول المتابعة مع الأخصائية.", "📆 طلب متابعة يومية"),
+}
+
+async def finish_request(update, context, step, username, text, media=None):
+    """إنهاء طلب مصنف: فتحه في طابور الطلبات، مسح الحالة، الرد، عرض القائمة، وإشعار الأدمن (مع الملف إن وُجد)"""
+    user_id = update.effective_user.id
+    reply, title = REQUEST_REPLIES[step]
+    request_id = await triage.open_request(user_id, MESSAGE_TYPES[step], text)
+    await storage.clear_user_state(user_id)
+    await update.message.reply_text(reply)
+    await show_main_menu(context, update.effective_chat.id)
+    notifier.notify(MESSAGE_TYPES[step], f"{title} #{request_id} من @{username} (ID: {user_id}):\n{text}",
+                    (media.kind, media.file_id) if media else None, (user_id, request_id))
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or "غير معروف"
-    state = get_user_state(user_id)
+    state = await storage.get_user_state(user_id)
+    step = state.step if state else None
     text = update.message.text
 
-    # حفظ الرسالة في قاعدة البيانات
-    save_message(user_id, username, text, state or "general")
+    # حفظ الرسالة في قاعدة البيانات مرة واحدة بنوعها الفعلي
+    storage.save_message(user_id, username, text, MESSAGE_TYPES.get(step, step or "general"))
 
-    # إرسال نسخة إلى الأدمن
-    if ADMIN_ID:
-        try:
-            await context.bot.send_message(ADMIN_ID, f"📩 رسالة جديدة من @{username} (ID: {user_id}):\n{text}")
-        except:
-            pass
+    # إرسال نسخة إلى الأدمن (الطلبات المصنفة لها إشعارها الخاص أدناه)
+    if step not in MESSAGE_TYPES:
+        notifier.notify("message", f"📩 رسالة جديدة من @{username} (ID: {user_id}):\n{text}", link=(user_id, None))
 
-    if state and state.startswith("waiting_name_"):
-        _, date, time = state.split("_", 2)
-        set_user_state(user_id, f"waiting_phone_{date}_{time}_{text}")
+    if step == "waiting_name":
+        await storage.set_user_state(user_id, UserState("waiting_phone", {**state.payload, "name": text}))
         await update.message.reply_text("📞 أرسل رقم هاتفك:")
-    elif state and state.startswith("waiting_phone_"):
-        _, date, time, name = state.split("_", 3)
+    elif step == "waiting_phone":
+        date, time, name = state.payload["date"], state.payload["time"], state.payload["name"]
         phone = text
-        save_booking(user_id, name, phone, date, time)
-        clear_user_state(user_id)
-        await update.message.reply_text(f"✅ تم حجز موعدك يوم {date} الساعة {time}\nشكراً لك 💚")
-        await show_main_menu(context, update.effective_chat.id)
-        if ADMIN_ID:
-            await context.bot.send_message(ADMIN_ID, f"📅 حجز جديد:\n👤 {name}\n📞 {phone}\n📆 {date} - {time}")
-    elif state == "waiting_inquiry":
-        clear_user_state(user_id)
-        save_message(user_id, username, text, "inquiry")
-        await update.message.reply_text("🙏 تم استلام استفسارك، سنرد بأقرب وقت.")
-        await show_main_menu(context, update.effective_chat.id)
-        if ADMIN_ID:
-            await context.bot.send_message(ADMIN_ID, f"📝 استفسار جديد من @{username} (ID: {user_id}):\n{text}")
-    elif state == "waiting_diet_edit":
-        clear_user_state(user_id)
-        save_message(user_id, username, text, "diet_edit")
-        await update.message.reply_text("✅ تم استلام طلب تعديل النظام الغذائي، سنقوم بمراجعته وإرسال النظام المحدث.")
-        await show_main_menu(context, update.effective_chat.id)
-        if ADMIN_ID:
-            await context.bot.send_message(ADMIN_ID, f"🔄 طلب تعديل نظام غذائي من @{username} (ID: {user_id}):\n{text}")
-    elif state == "waiting_analysis":
-        clear_user_state(user_id)
-        save_message(user_id, username, text, "analysis")
-        await update.message.reply_text("✅ تم استلام التحليل، سنقوم بشرحه وإرسال التفسير.")
-        await show_main_menu(context, update.effective_chat.id)
-        if ADMIN_ID:
-            await context.bot.send_message(ADMIN_ID, f"🔬 طلب شرح تحليل من @{username} (ID: {user_id}):\n{text}")
-    elif state == "waiting_medical_diet":
-        clear_user_state(user_id)
-        save_message(user_id, username, text, "medical_diet")
-        await update.message.reply_text("✅ تم استلام طلب البرنامج الغذائي الطبي، سنقوم بإعداده وإرساله.")
-        await show_main_menu(context, update.effective_chat.id)
-        if ADMIN_ID:
-            await context.bot.send_message(ADMIN_ID, f"🏥 طلب برنامج غذائي طبي من @{username} (ID: {user_id}):\n{text}")
-    elif state == "waiting_daily_followup":
-        clear_user_state(user_id)
-        save_message(user_id, username, text, "daily_followup")
-        await update.message.reply_text("✅ تم استلام طلب المتابعة اليومية، سنقوم بترتيب جدول المتابعة مع الأخصائية.")
+        booked = await slots.confirm(user_id, name, phone, date, time)
+        await storage.clear_user_state(user_id)
+        if not booked:
+            await update.message.reply_text("⚠️ انتهت مهلة الحجز المؤقت وامتلأ هذا الموعد، اختر موعداً آخر من القائمة.")
+            await show_main_menu(context, update.effective_chat.id)
+            return
+        when = f"{slots.day_label(date)} الساعة {slots.time_label(time)}"
+        await update.message.reply_text(f"✅ تم حجز موعدك يوم {when}\nشكراً لك 💚")
         await show_main_menu(context, update.effective_chat.id)
-        if ADMIN_ID:
-            await context.bot.send_message(ADMIN_ID, f"📆 طلب متابعة يومية من @{username} (ID: {user_id}):\n{text}")
+        notifier.notify("booking", f"📅 حجز جديد:\n👤 {name}\n📞 {phone}\n📆 {when}", link=(user_id, None))
+        await schedule_reminders(booked, date, time)
+    elif step in REQUEST_REPLIES:
+        await finish_request(update, context, step, username, text)
+
+async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """الصور والمستندات (صورة التحليل مثلاً): تُحفظ مرتبطة بصف الرسالة وتُرسل للأدمن بمعرّف الملف"""
+    user_id = update.effective_user.id
+    username = update.effective_user.username or "غير معروف"
+    state = await storage.get_user_state(user_id)
+    step = state.step if state else None
+    if step in ("waiting_name", "waiting_phone"):
+        await update.message.reply_text("✍️ أرسل المطلوب كنص من فضلك.")
+        return
+
+    media = media_from_message(update.message)
+    label = "🖼️ صورة" if media.kind == "photo" else f"📎 ملف {media.file_name or ''}".rstrip()
+    text = f"{label}\n{update.message.caption}" if update.message.caption else label
+    _, stored = await storage.save_media_message(user_id, username, text, MESSAGE_TYPES.get(step, "general"), media)
+    if not stored:
+        media_store.submit(media)
+
+    if step in REQUEST_REPLIES:
+        await finish_request(update, context, step, username, text, media)
+    else:
+        storage.update_last_message(user_id)
+        notifier.notify("message", f"📩 رسالة جديدة من @{username} (ID: {user_id}):\n{text}",
+                        (media.kind, media.file_id), (user_id, None))
 
 
 # ==================== لوحة تحكم الأدمن ====================
@@ -410,73 +448,521 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("📋 عرض المواعيد", callback_data="admin_bookings")],
         [InlineKeyboardButton("📩 عرض الرسائل", callback_data="admin_messages")],
-        [InlineKeyboardButton("👥 عدد المستخدمين", callback_data="admin_users")],
+        [InlineKeyboardButton("📥 الطلبات المفتوحة", callback_data="admin_requests")],
+        [InlineKeyboardButton("📊 الإحصائيات", callback_data="admin_stats")],
     ]
     await update.message.reply_text("🧑‍💻 لوحة تحكم الأدمن:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    if query.from_user.id != ADMIN_ID:
+MSG_TYPE_NAMES = {
+    "inquiry": "استفسار",
+    "diet_edit": "تعديل نظام",
+    "analysis": "تحليل",
+    "medical_diet": "برنامج طبي",
+    "daily_followup": "متابعة يومية",
+    "general": "عام"
+}
+
+def page_cursor(direction, cursor):
+    """تحويل اتجاه الصفحة (n للأقدم، p للأحدث) إلى معاملي before/after"""
+    cursor = int(cursor) if cursor else None
+    return (cursor if direction == "n" else None), (cursor if direction == "p" else None)
+
+async def render_admin_messages(message_type=None, user_id=None, direction=None, cursor=None):
+    before, after = page_cursor(direction, cursor)
+    messages, has_newer, has_older = await storage.page_messages(message_type, user_id, before, after)
+    filters = ":".join([message_type or "", str(user_id or "")])
+
+    title = "📩 الرسائل"
+    if message_type:
+        title += f" - {MSG_TYPE_NAMES.get(message_type, message_type)}"
+    if user_id:
+        title += f" - المستخدم {user_id}"
+    if not messages:
+        text = f"{title}\n\nلا توجد رسائل حالياً."
+    else:
+        text = f"{title}:\n\n"
+        for msg in messages:
+            msg_type = MSG_TYPE_NAMES.get(msg[4], msg[4])
+            text += f"👤 @{msg[2] or 'غير معروف'} (ID: {msg[1]})\n"
+            text += f"📝 {msg_type}\n"
+            text += f"💬 {msg[3][:50]}{'...' if len(msg[3]) > 50 else ''}\n"
+            text += f"⏰ {msg[5]}\n\n"
+
+    keyboard = []
+    nav = []
+    if messages and has_newer:
+        nav.append(InlineKeyboardButton("⬅️ الأحدث", callback_data=f"admin_msgs:{filters}:p:{messages[0][0]}"))
+    if messages and has_older:
+        nav.append(InlineKeyboardButton("الأقدم ➡️", callback_data=f"admin_msgs:{filters}:n:{messages[-1][0]}"))
+    if nav:
+        keyboard.append(nav)
+    type_buttons = [
+        InlineKeyboardButton(name, callback_data=f"admin_msgs:{key}:{user_id or ''}::")
+        for key, name in MSG_TYPE_NAMES.items()
+    ]
+    keyboard += [type_buttons[i:i + 3] for i in range(0, len(type_buttons), 3)]
+    keyboard.append([InlineKeyboardButton("🔄 كل الأنواع", callback_data=f"admin_msgs::{user_id or ''}::")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def render_admin_bookings(date=None, direction=None, cursor=None):
+    before, after = page_cursor(direction, cursor)
+    bookings, has_newer, has_older = await storage.page_bookings(date, before, after)
+    title = f"📅 مواعيد يوم {date}" if date else "📅 المواعيد"
+    if not bookings:
+        text = f"{title}\n\nلا توجد مواعيد حالياً."
+    else:
+        text = f"{title}:\n\n" + "\n".join([f"{b[1]} - {b[3]} {b[4]} ({b[2]})" for b in bookings])
+
+    nav = []
+    if bookings and has_newer:
+        nav.append(InlineKeyboardButton("⬅️ الأحدث", callback_data=f"admin_bkgs:{date or ''}:p:{bookings[0][0]}"))
+    if bookings and has_older:
+        nav.append(InlineKeyboardButton("الأقدم ➡️", callback_data=f"admin_bkgs:{date or ''}:n:{bookings[-1][0]}"))
+    return text, InlineKeyboardMarkup([nav] if nav else [])
+
+async def admin_messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/messages [user_id] - رسائل مستخدم معين أو كل الرسائل"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    user_id = int(context.args[0]) if context.args and context.args[0].isdigit() else None
+    text, markup = await render_admin_messages(user_id=user_id)
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def admin_bookings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/bookings [date] - مواعيد يوم معين أو كل المواعيد"""
+    if update.effective_user.id != ADMIN_ID:
         return
-    if query.data == "admin_bookings":
-        bookings = db_execute("SELECT name, phone, date, time FROM bookings ORDER BY created_at DESC LIMIT 10", fetch=True)
-        if not bookings:
-            await query.edit_message_text("لا توجد مواعيد حالياً.")
+    date = " ".join(context.args) if context.args else None
+    text, markup = await render_admin_bookings(date)
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def admin_queues_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/queues - عمق طوابير أجزاء المعالجة"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    processor = context.application.update_processor
+    if not isinstance(processor, ShardedUpdateProcessor):
+        await update.message.reply_text("المعالجة متسلسلة، لا توجد أجزاء.")
+        return
+    lines = [f"#{s['shard']}: الآن {s['depth']} | الأقصى {s['peak']} | تمت {s['processed']}" for s in processor.stats()]
+    await update.message.reply_text("📊 طوابير المعالجة:\n\n" + "\n".join(lines))
+
+# حد Telegram لرفع الملفات عبر Bot API
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+async def admin_export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export messages|bookings FROM TO [csv|jsonl] - تصدير السجلات المنشأة بين تاريخين (شاملاً)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    usage = "الاستخدام: /export messages|bookings 2026-09-01 2026-09-30 [csv|jsonl]"
+    args = context.args or []
+    if len(args) not in (3, 4) or args[0] not in ("messages", "bookings"):
+        await update.message.reply_text(usage)
+        return
+    table, fmt = args[0], args[3].lower() if len(args) == 4 else "csv"
+    try:
+        start = datetime.fromisoformat(args[1])
+        end = datetime.fromisoformat(args[2]) + timedelta(days=1)
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    if fmt not in EXPORT_FORMATS or end <= start:
+        await update.message.reply_text(usage)
+        return
+
+    filename = f"{table}_{args[1]}_{args[2]}.{fmt}"
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        # الصفوف تُكتب من المؤشر إلى ملف مؤقت على خيط القراءة، فلا تُجمع في الذاكرة
+        count = await storage.read(write_export, table, start, end, fmt, path, op=f"export.{table}")
+        if not count:
+            await update.message.reply_text("لا توجد سجلات في هذا النطاق.")
             return
-        text = "📅 آخر 10 مواعيد:\n\n" + "\n".join([f"{b[0]} - {b[2]} {b[3]} ({b[1]})" for b in bookings])
-        await query.edit_message_text(text)
-    elif query.data == "admin_messages":
-        messages = db_execute("SELECT username, message_text, message_type, created_at FROM messages ORDER BY created_at DESC LIMIT 15", fetch=True)
-        if not messages:
-            await query.edit_message_text("لا توجد رسائل حالياً.")
+        if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+            await update.message.reply_text("⚠️ الملف أكبر من 50MB، جرّب نطاقاً أقصر.")
             return
-        text = "📩 آخر 15 رسالة:\n\n"
-        for msg in messages:
-            msg_type_names = {
-                "inquiry": "استفسار",
-                "diet_edit": "تعديل نظام",
-                "analysis": "تحليل",
-                "medical_diet": "برنامج طبي",
-                "daily_followup": "متابعة يومية",
-                "general": "عام"
-            }
-            msg_type = msg_type_names.get(msg[2], msg[2])
-            text += f"👤 @{msg[0] or 'غير معروف'}\n"
-            text += f"📝 {msg_type}\n"
-            text += f"💬 {msg[1][:50]}{'...' if len(msg[1]) > 50 else ''}\n"
-            text += f"⏰ {msg[3]}\n\n"
-        await query.edit_message_text(text)
-    elif query.data == "admin_users":
-        users = db_execute("SELECT COUNT(*) FROM users", fetch=True)[0][0]
-        await query.edit_message_text(f"👥 عدد المستخدمين المسجلين: {users}")
+        caption = f"📤 {count} سجل"
+        cutoff = retention.cutoff(table)
+        if cutoff and start < cutoff:
+            caption += f"\nالسجلات الأقدم من مدة الاحتفاظ موجودة في أرشيف {ARCHIVE_DIR}"
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, filename=filename, caption=caption)
+    finally:
+        os.remove(path)
+
+SEARCH_PAGE_SIZE = 10
+# نتائج كل نافذة تُرتب حسب الصلة، والأقدم منها في نوافذ تالية بزر «أقدم»
+SEARCH_WINDOW = 2000
+
+async def render_admin_search(match, offset=0, before=None):
+    rows, more, older = await storage.search_messages(match, offset, SEARCH_PAGE_SIZE, SEARCH_WINDOW, before)
+    # before يحدد النافذة (أحدث SEARCH_WINDOW تطابق قبل تلك الرسالة) وoffset الصفحة داخلها
+    suffix = f":{before}" if before else ""
+    if not rows:
+        text = "🔍 لا توجد نتائج." if not offset and not before else "🔍 لا توجد نتائج أخرى."
+    else:
+        title = "🔍 نتائج أقدم" if before else "🔍 نتائج البحث"
+        text = f"{title} ({offset + 1} - {offset + len(rows)}):\n\n"
+        for msg in rows:
+            msg_type = MSG_TYPE_NAMES.get(msg[4], msg[4])
+            text += f"👤 @{msg[2] or 'غير معروف'} (ID: {msg[1]}) - {msg_type}\n"
+            text += f"💬 {msg[3][:120]}{'...' if len(msg[3]) > 120 else ''}\n"
+            text += f"⏰ {str(msg[5])[:16]}\n\n"
+    if older:
+        text += f"ℹ️ الترتيب حسب الصلة ضمن أحدث {SEARCH_WINDOW} تطابق؛ للرسائل الأقدم اضغط «أقدم»."
+    nav = []
+    if offset:
+        nav.append(InlineKeyboardButton("⬅️ السابق", callback_data=f"admin_srch:{max(offset - SEARCH_PAGE_SIZE, 0)}{suffix}"))
+    elif before:
+        nav.append(InlineKeyboardButton("⏩ الأحدث", callback_data="admin_srch:0"))
+    if more:
+        nav.append(InlineKeyboardButton("التالي ➡️", callback_data=f"admin_srch:{offset + SEARCH_PAGE_SIZE}{suffix}"))
+    if older:
+        nav.append(InlineKeyboardButton("⏪ أقدم", callback_data=f"admin_srch:0:{older}"))
+    return text, InlineKeyboardMarkup([nav]) if nav else None
+
+async def admin_search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/search كلمات - بحث في نصوص الرسائل مع تطبيع الهمزات والتاء المربوطة والتشكيل"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    match = match_query(" ".join(context.args or []))
+    if not match:
+        await update.message.reply_text("الاستخدام: /search كلمة أو أكثر")
+        return
+    # نص البحث أطول من حد callback_data (64 بايت)، فيبقى في بيانات الأدمن وتحمل الأزرار الإزاحة فقط
+    context.user_data["search"] = match
+    text, markup = await render_admin_search(match)
+    await update.message.reply_text(text, reply_markup=markup)
+
+# ==================== طابور الطلبات والرد ====================
+async def render_admin_requests(request_type=None):
+    counts = await triage.open_counts()
+    requests = await triage.open_requests(request_type)
+    now = datetime.now()
+    title = "📥 الطلبات المفتوحة"
+    if request_type:
+        title += f" - {MSG_TYPE_NAMES.get(request_type, request_type)}"
+    if not requests:
+        text = f"{title}\n\nلا توجد طلبات بانتظار الرد 🎉"
+    else:
+        text = f"{title} (الأقدم أولاً):\n\n"
+        for request_id, user_id, kind, summary, created_at in requests:
+            age = int((now - datetime.fromisoformat(str(created_at))).total_seconds() // 3600)
+            flag = "🚨" if age >= SLA_HOURS else "⏰" if age >= SLA_WARN_HOURS else "🟢"
+            text += f"{flag} #{request_id} {MSG_TYPE_NAMES.get(kind, kind)} - منذ {age} ساعة (ID: {user_id})\n"
+            text += f"💬 {(summary or '')[:80]}\n\n"
+        text += "للرد: رد على إشعار الطلب، أو /reply رقم_الطلب النص. للإغلاق دون رد: /close رقم_الطلب"
+    buttons = [
+        InlineKeyboardButton(f"{MSG_TYPE_NAMES.get(kind, kind)} ({count})", callback_data=f"admin_reqs:{kind}")
+        for kind, count in sorted(counts.items())
+    ]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    keyboard.append([InlineKeyboardButton("🔄 كل الأنواع", callback_data="admin_requests")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def send_admin_reply(update, context, user_id, request_id, text=None):
+    """إيصال رد الأدمن للمستخدم: نسخ رسالة الأدمن كما هي (نص أو ملف دون إعادة رفع) أو إرسال text"""
+    try:
+        if text is None:
+            await context.bot.copy_message(user_id, update.effective_chat.id, update.message.message_id)
+        else:
+            await context.bot.send_message(user_id, text)
+    except Forbidden:
+        await update.message.reply_text("⚠️ تعذر الإرسال: المستخدم حظر البوت.")
+        return
+    except BadRequest as e:
+        # المحادثة غير موجودة، أو رسالة لا يمكن نسخها (مثل الاستطلاعات)
+        await update.message.reply_text(f"⚠️ تعذر الإرسال: {e.message}")
+        return
+    if request_id:
+        await triage.set_status(request_id, "answered")
+    await update.message.reply_text(f"✅ تم إرسال الرد{f' على الطلب #{request_id}' if request_id else ''}.")
+
+async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """رد الأدمن على إشعار في محادثته يُرسل لصاحب الإشعار"""
+    target = await triage.lookup(update.message.reply_to_message.message_id)
+    if not target:
+        await update.message.reply_text("⚠️ هذه الرسالة غير مرتبطة بمستخدم. استخدم /reply رقم_الطلب النص")
+        return
+    await send_admin_reply(update, context, *target)
+
+async def admin_reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reply رقم_الطلب النص - الرد على طلب (بديل الرد على الإشعار، مثلاً للطلبات المدمجة في ملخص)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    args = context.args or []
+    request_id = args[0].lstrip("#") if args else ""
+    if len(args) < 2 or not request_id.isdigit():
+        await update.message.reply_text("الاستخدام: /reply رقم_الطلب النص")
+        return
+    request = await triage.get(int(request_id))
+    if not request:
+        await update.message.reply_text("⚠️ لا يوجد طلب بهذا الرقم.")
+        return
+    # النص كما كتبه الأدمن بأسطره، لا context.args المقسمة على المسافات
+    text = update.message.text.split(None, 2)[2]
+    await send_admin_reply(update, context, request[0], int(request_id), text)
+
+async def admin_requests_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/requests - الطلبات المفتوحة الأقدم أولاً"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    text, markup = await render_admin_requests()
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def admin_close_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/close رقم_الطلب - إغلاق طلب دون رد"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    request_id = context.args[0].lstrip("#") if context.args else ""
+    if not request_id.isdigit():
+        await update.message.reply_text("الاستخدام: /close رقم_الطلب")
+        return
+    closed = await triage.set_status(int(request_id), "closed")
+    await update.message.reply_text(f"✅ تم إغلاق الطلب #{request_id}." if closed else "⚠️ الطلب غير موجود أو ليس مفتوحاً.")
+
+# ==================== البث الجماعي ====================
+BROADCAST_STATUS = {"pending": "⏳ بالانتظار", "running": "📤 جارٍ", "done": "✅ اكتمل", "cancelled": "⛔ أُلغي"}
+
+async def admin_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast النص - إرسال النص لكل المستخدمين عبر المجدول"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    parts = update.message.text.split(None, 1)
+    if len(parts) < 2:
+        await update.message.reply_text("الاستخدام: /broadcast النص")
+        return
+    broadcast_id, total = await broadcasts.create(parts[1])
+    await update.message.reply_text(
+        f"📣 بدأ البث #{broadcast_id} إلى {total} مستخدم.\nالمتابعة: /broadcasts، الإيقاف: /stop_broadcast {broadcast_id}"
+    )
+
+async def admin_broadcasts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcasts - تقدم آخر البثوث وإحصاءات التسليم"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    rows = await broadcasts.recent()
+    if not rows:
+        await update.message.reply_text("📣 لا توجد بثوث بعد.")
+        return
+    text = "📣 آخر البثوث:\n\n"
+    for broadcast_id, status, total, sent, blocked, failed, body in rows:
+        done = sent + blocked + failed
+        progress = f"{done}/{total}" + (f" ({done * 100 // total}%)" if total else "")
+        text += f"#{broadcast_id} {BROADCAST_STATUS.get(status, status)} {progress}\n"
+        text += f"✅ {sent}  🚫 حظروا البوت {blocked}  ⚠️ فشل {failed}\n💬 {body[:60]}\n\n"
+    await update.message.reply_text(text)
+
+async def admin_stop_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stop_broadcast رقم - إيقاف بث جارٍ (الرسائل المرسلة لا تُسترجع)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    broadcast_id = context.args[0].lstrip("#") if context.args else ""
+    if not broadcast_id.isdigit():
+        await update.message.reply_text("الاستخدام: /stop_broadcast رقم_البث")
+        return
+    cancelled = await broadcasts.cancel(int(broadcast_id))
+    await update.message.reply_text(f"⛔ تم إيقاف البث #{broadcast_id}." if cancelled else "⚠️ البث غير موجود أو انتهى.")
+
+admin_only = [require_admin(ADMIN_ID)]
+
+@router.route("admin_bookings", middleware=admin_only)
+async def admin_bookings(query, context):
+    text, markup = await render_admin_bookings()
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_bkgs", prefix=True, middleware=admin_only)
+async def admin_bookings_page(query, context, date, direction, cursor):
+    text, markup = await render_admin_bookings(date or None, direction, cursor)
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_messages", middleware=admin_only)
+async def admin_messages(query, context):
+    text, markup = await render_admin_messages()
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_msgs", prefix=True, middleware=admin_only)
+async def admin_messages_page(query, context, message_type, user_id, direction, cursor):
+    text, markup = await render_admin_messages(message_type or None, int(user_id) if user_id else None, direction, cursor)
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_requests", middleware=admin_only)
+async def admin_requests(query, context):
+    text, markup = await render_admin_requests()
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_reqs", prefix=True, middleware=admin_only)
+async def admin_requests_by_type(query, context, request_type):
+    text, markup = await render_admin_requests(request_type or None)
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_srch", prefix=True, middleware=admin_only)
+async def admin_search_page(query, context, offset, before=""):
+    match = context.user_data.get("search")
+    if not match:
+        await query.edit_message_text("انتهت جلسة البحث، أعد إرسال /search")
+        return
+    text, markup = await render_admin_search(match, int(offset), int(before) if before else None)
+    await query.edit_message_text(text, reply_markup=markup)
+
+# ==================== الإحصائيات ====================
+STATS_DAYS = 7
+STATS_WEEKS = 8
+
+def stats_line(values):
+    by_metric = {}
+    for (metric, _), value in values.items():
+        by_metric[metric] = by_metric.get(metric, 0) + value
+    return (f"👤 جدد {by_metric.get('new_users', 0)} | 🟢 نشطون {by_metric.get('active_users', 0)} | "
+            f"💬 {by_metric.get('messages', 0)} | 📅 {by_metric.get('bookings', 0)}")
+
+async def render_admin_stats(view="d"):
+    """الإحصاءات من صفوف daily_stats الجاهزة: يومي لآخر STATS_DAYS يوم أو أسبوعي لآخر STATS_WEEKS أسبوع"""
+    today = datetime.now().date()
+    days = STATS_DAYS if view == "d" else STATS_WEEKS * 7
+    since = today - timedelta(days=days - 1)
+    per_day = {}
+    for day, metric, key, value in await storage.daily_stats(since.isoformat()):
+        per_day.setdefault(day, {})[(metric, key)] = value
+
+    text = f"📊 الإحصائيات\n👥 إجمالي المستخدمين: {await storage.total_users()}\n\n"
+    if view == "d":
+        text += f"آخر {STATS_DAYS} أيام:\n"
+        for i in range(STATS_DAYS):
+            day = (today - timedelta(days=i)).isoformat()
+            text += f"📆 {slots.day_label(day)}: {stats_line(per_day.get(day, {}))}\n"
+    else:
+        text += f"آخر {STATS_WEEKS} أسابيع:\n"
+        for week in range(STATS_WEEKS):
+            end = today - timedelta(days=7 * week)
+            start = end - timedelta(days=6)
+            values = {}
+            for i in range(7):
+                for key, value in per_day.get((start + timedelta(days=i)).isoformat(), {}).items():
+                    values[key] = values.get(key, 0) + value
+            # النشطون في الأسبوع ليسوا مجموع نشطي الأيام، فيُعدّون بلا تكرار من daily_active
+            values = {k: v for k, v in values.items() if k[0] != "active_users"}
+            values[("active_users", "")] = await storage.weekly_active(start.isoformat(), end.isoformat())
+            text += f"🗓️ {start.day}/{start.month} - {end.day}/{end.month}: {stats_line(values)}\n"
+
+    # التفصيل حسب نوع الرسالة ووقت الموعد للفترة كلها
+    totals = {}
+    for values in per_day.values():
+        for key, value in values.items():
+            totals[key] = totals.get(key, 0) + value
+    types = [f"{MSG_TYPE_NAMES.get(k, k or 'غير محدد')} {v}" for (m, k), v in sorted(totals.items()) if m == "messages"]
+    times = [f"{slots.time_label(k)} {v}" for (m, k), v in sorted(totals.items()) if m == "bookings"]
+    if types:
+        text += "\n💬 الرسائل حسب النوع: " + " | ".join(types)
+    if times:
+        text += "\n📅 الحجوزات حسب الوقت: " + " | ".join(times)
+
+    keyboard = [[
+        InlineKeyboardButton("📆 يومي", callback_data="admin_stats:d"),
+        InlineKeyboardButton("🗓️ أسبوعي", callback_data="admin_stats:w"),
+    ]]
+    return text, InlineKeyboardMarkup(keyboard)
+
+@router.route("admin_stats", middleware=admin_only)
+@router.route("admin_users", middleware=admin_only)
+async def admin_stats(query, context):
+    # admin_users زر لوحة الأدمن القديم، يبقى لرسائل اللوحة المرسلة سابقاً
+    text, markup = await render_admin_stats()
+    await query.edit_message_text(text, reply_markup=markup)
+
+@router.route("admin_stats", prefix=True, middleware=admin_only)
+async def admin_stats_view(query, context, view):
+    text, markup = await render_admin_stats(view)
+    await query.edit_message_text(text, reply_markup=markup)
 
 
 # ==================== تشغيل البوت ====================
+def build_application(concurrent_updates=False, **builder_options):
+    """إنشاء التطبيق وتسجيل المعالجات؛ builder_options تُمرَّر إلى ApplicationBuilder (مثل request للاختبار)"""
+    # طلبات Bot API الصادرة تمر عبر InstrumentedRequest لقياس زمنها (getUpdates الطويل مستثنى)
+    if "request" not in builder_options:
+        builder_options["request"] = metrics.InstrumentedRequest()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(concurrent_updates)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    for name, value in builder_options.items():
+        builder = getattr(builder, name)(value)
+    app = builder.build()
+
+    app.add_handler(TypeHandler(Update, skip_duplicate_update), group=-1)
+    app.add_handler(TypeHandler(Update, complete_update), group=1)
+
+    # الأوامر والرسائل تُقاس بـ instrumented، والأزرار بـ middleware الموجّه timed لكل مسار
+    commands = {
+        "start": start,
+        "admin": admin_panel,
+        "messages": admin_messages_command,
+        "bookings": admin_bookings_command,
+        "queues": admin_queues_command,
+        "export": admin_export_command,
+        "search": admin_search_command,
+        "requests": admin_requests_command,
+        "reply": admin_reply_command,
+        "close": admin_close_command,
+        "broadcast": admin_broadcast_command,
+        "broadcasts": admin_broadcasts_command,
+        "stop_broadcast": admin_stop_broadcast_command,
+    }
+    for name, callback in commands.items():
+        app.add_handler(CommandHandler(name, metrics.instrumented(f"command:{name}")(callback)))
+    # كل الأزرار تمر عبر الموجّه، بما فيها أزرار لوحة الأدمن
+    app.add_handler(CallbackQueryHandler(router.dispatch))
+    # رد الأدمن على إشعار يسبق معالج الرسائل العام
+    app.add_handler(MessageHandler(
+        filters.Chat(ADMIN_ID) & filters.REPLY & ~filters.COMMAND, metrics.instrumented("admin_reply")(handle_admin_reply)
+    ))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, metrics.instrumented("text")(handle_text)))
+    app.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, metrics.instrumented("media")(handle_media)))
+    app.add_error_handler(on_error)
+    return app
+
+def run(loop):
+    """تشغيل واحد حتى وصول إشارة الإيقاف"""
+    # معالجة متوازية بين المستخدمين ومتسلسلة لكل مستخدم
+    app = build_application(concurrent_updates=ShardedUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+    if BOT_MODE == "webhook":
+        logger.info("✅ البوت يعمل الآن (webhook): Be Healthy Clinic")
+        loop.run_until_complete(webhook.serve(app, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                                              url=WEBHOOK_URL, secret=WEBHOOK_SECRET))
+        return
+
+    logger.info("✅ البوت يعمل الآن: Be Healthy Clinic")
+    app.run_polling(
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=False,  # رسائل المرضى أثناء التوقف تُعالج عند العودة، والمكرر منها يُتجاهل
+        close_loop=False  # الحلقة نفسها تخدم المحاولة التالية
+    )
+
 def main():
-    try:
-        init_db()
-        app = Application.builder().token(BOT_TOKEN).build()
-
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("admin", admin_panel))
-        app.add_handler(CallbackQueryHandler(button_handler))
-        app.add_handler(CallbackQueryHandler(admin_handler))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-
-        logger.info("✅ البوت يعمل الآن: Be Healthy Clinic")
-        # إعدادات للعمل 24/7
-        app.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,  # تجاهل الرسائل القديمة عند إعادة التشغيل
-            close_loop=False  # عدم إغلاق الحلقة عند الخطأ
-        )
-    except Exception as e:
-        logger.error(f"❌ خطأ في تشغيل البوت: {e}")
-        # إعادة المحاولة بعد 5 ثواني
-        import time
-        time.sleep(5)
-        main()  # إعادة التشغيل تلقائياً
+    """مشرف التشغيل: إعادة المحاولة بعد كل عطل بانتظار يتضاعف، حتى الإيقاف الطبيعي بإشارة"""
+    # حلقة أحداث واحدة لكل المحاولات، فطوابير المكونات المنشأة عند الاستيراد تبقى صالحة
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    delay = RESTART_MIN_SECONDS
+    while True:
+        startup["at"] = monotonic()
+        startup_seconds.clear()
+        try:
+            run(loop)
+            return
+        except Exception as e:
+            logger.exception(f"❌ خطأ في تشغيل البوت: {e}")
+        if monotonic() - startup["at"] >= RESTART_RESET_SECONDS:
+            delay = RESTART_MIN_SECONDS
+        logger.warning(f"🔁 إعادة تشغيل البوت بعد {delay:g} ثانية")
+        sleep(delay)
+        delay = min(delay * 2, RESTART_MAX_SECONDS)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""كتالوج المحتوى: نصوص القوائم والأسئلة المتكررة ولوحات الأزرار من ملف content.json.
+يُحلَّل الملف مرة واحدة إلى كائنات جاهزة غير قابلة للتعديل، ويُعاد تحميله عند تغيّره دون إعادة تشغيل"""
+
+import asyncio
+import json
+import logging
+import os
+from types import MappingProxyType
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+
+def _text(value):
+    # النص الطويل يُكتب في الملف كقائمة أسطر لسهولة التحرير
+    return "\n".join(value) if isinstance(value, list) else value
+
+
+def _markup(rows):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(button["text"], callback_data=button["callback"]) for button in row]
+        for row in rows
+    ])
+
+
+class Catalog:
+    """نسخة واحدة من المحتوى بعد التحليل؛ لا تتغير بعد إنشائها"""
+
+    def __init__(self, raw, required_texts=(), required_keyboards=()):
+        self.texts = MappingProxyType({name: _text(value) for name, value in raw["texts"].items()})
+        self.keyboards = MappingProxyType({name: _markup(rows) for name, rows in raw["keyboards"].items()})
+
+        faq = raw["faq"]
+        items = faq["items"]
+        self.faq_menu = _markup(
+            [[{"text": item["title"], "callback": f"faq:{item['id']}"}] for item in items] + [[faq["back"]]]
+        )
+        self.faq_answers = MappingProxyType({str(item["id"]): _text(item["answer"]) for item in items})
+
+        # ملف JSON سليم لكن ينقصه اسم تستخدمه المعالجات يُرفض هنا، لا عند أول ضغطة زر
+        missing = [f"texts.{name}" for name in required_texts if name not in self.texts]
+        missing += [f"keyboards.{name}" for name in required_keyboards if name not in self.keyboards]
+        if missing:
+            raise ValueError(f"أسماء ناقصة في المحتوى: {', '.join(missing)}")
+
+    @classmethod
+    def from_file(cls, path, required_texts=(), required_keyboards=()):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), required_texts, required_keyboards)
+
+
+class ContentStore:
+    """يحمل الكتالوج الحالي ويستبدله كاملاً عند تعديل الملف (الاستبدال إسناد واحد فهو ذري)"""
+
+    def __init__(self, path, interval=2, required_texts=(), required_keyboards=()):
+        self.path = path
+        self.interval = interval
+        # الأسماء التي يستخدمها البوت؛ النسخة التي ينقصها أحدها لا تحل محل الحالية
+        self.required_texts = tuple(required_texts)
+        self.required_keyboards = tuple(required_keyboards)
+        self.catalog = None
+        self._stamp = None
+        self._task = None
+
+    def _file_stamp(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        stamp = self._file_stamp()
+        self.catalog = Catalog.from_file(self.path, self.required_texts, self.required_keyboards)
+        self._stamp = stamp
+        logger.info(f"📚 تم تحميل المحتوى من {self.path}")
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                stamp = self._file_stamp()
+            except OSError:
+                logger.exception(f"⚠️ تعذر قراءة {self.path}")
+                continue
+            if stamp == self._stamp:
+                continue
+            self._stamp = stamp
+            try:
+                catalog = await asyncio.to_thread(
+                    Catalog.from_file, self.path, self.required_texts, self.required_keyboards
+                )
+            except Exception:
+                # ملف ناقص أو تالف أو تنقصه أسماء مطلوبة: تبقى النسخة الحالية حتى يُحفظ الملف مرة أخرى
+                logger.exception(f"⚠️ تعذر إعادة تحميل {self.path}، ستبقى النسخة السابقة")
+                continue
+            self.catalog = catalog
+            logger.info(f"🔄 أعيد تحميل المحتوى من {self.path}")
+
+    def start(self):
+        if self.catalog is None:
+            self.load()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # ---------- الوصول ----------
+    def text(self, name):
+        return self.catalog.texts[name]
+
+    def keyboard(self, name):
+        return self.catalog.keyboards[name]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""خادم HTTP/1.1 صغير فوق asyncio للاستخدام المحلي (webhook ونقاط المراقبة) دون اعتماديات إضافية"""
+
+import asyncio
+import logging
+from collections import namedtuple
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+Request = namedtuple("Request", "method path query headers body")
+Response = namedtuple("Response", "status body content_type", defaults=(b"", "text/plain; charset=utf-8"))
+
+MAX_HEADER_LINES = 100
+
+
+class HTTPServer:
+    """routes: {(method, path): async handler(request) -> Response}"""
+
+    def __init__(self, routes, max_body=1024 * 1024, keepalive_timeout=75):
+        self.routes = routes
+        self.max_body = max_body
+        self.keepalive_timeout = keepalive_timeout
+        self._server = None
+        self._connections = set()
+        self._idle = set()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """إيقاف قبول الاتصالات ثم انتظار الطلبات الجارية حتى تكتمل"""
+        if self._server is None:
+            return
+        self._server.close()
+        # الاتصالات الخاملة (keep-alive) تُغلق فوراً، أما التي تعالج طلباً فتُنتظر
+        for task in self._idle:
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                self._idle.add(task)
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    await self._write(writer, Response(HTTPStatus.BAD_REQUEST, str(e)), False)
+                    break
+                finally:
+                    self._idle.discard(task)
+                if request is None:
+                    break
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write(writer, response, keep_alive)
+                if not keep_alive or not self._server or not self._server.is_serving():
+                    break
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            self._idle.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise ValueError("سطر طلب غير صالح")
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("عدد الترويسات كبير جداً")
+        length = int(headers.get("content-length") or 0)
+        if length > self.max_body:
+            raise ValueError("حجم الطلب أكبر من المسموح")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                return Response(HTTPStatus.METHOD_NOT_ALLOWED)
+            return Response(HTTPStatus.NOT_FOUND)
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception(f"خطأ أثناء معالجة {request.method} {request.path}")
+            return Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    async def _write(writer, response, keep_alive):
+        status = HTTPStatus(response.status)
+        body = response.body if isinstance(response.body, bytes) else response.body.encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
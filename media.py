@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""استقبال الصور والملفات: وصف الملف من الرسالة، ومخزن محلي معنون بالمحتوى يُملأ في الخلفية"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from collections import namedtuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+Media = namedtuple("Media", "kind file_id file_unique_id file_name mime_type file_size")
+
+CHUNK_SIZE = 64 * 1024
+
+
+def media_from_message(message):
+    """Media للصورة (بأكبر دقة متاحة) أو المستند، أو None إن لم تحمل الرسالة أياً منهما"""
+    if message.photo:
+        photo = message.photo[-1]
+        return Media("photo", photo.file_id, photo.file_unique_id, None, "image/jpeg", photo.file_size)
+    document = message.document
+    if document:
+        return Media("document", document.file_id, document.file_unique_id, document.file_name,
+                     document.mime_type, document.file_size)
+    return None
+
+
+class MediaStore:
+    """تنزيل الملفات بالتدفق إلى root/ab/cd/<sha256> دون تحميلها كاملة في الذاكرة.
+    التكرار يُكشف مرتين: بـ file_unique_id قبل التنزيل، وبالبصمة بعده (نفس المحتوى بمعرّفين مختلفين)"""
+
+    def __init__(self, storage, root, workers=2, max_bytes=20 * 1024 * 1024, timeout=60):
+        self.storage = storage
+        self.root = root
+        self.workers = workers
+        # حد Bot API لتنزيل الملفات عبر getFile هو 20MB
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.queue = asyncio.Queue()
+        self.bot = None
+        self._client = None
+        self._tasks = []
+
+    def submit(self, media):
+        if self.root:
+            self.queue.put_nowait(media)
+
+    def start(self, bot):
+        if not self.root:
+            return
+        self.bot = bot
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """إكمال التنزيلات المنتظرة قبل الإيقاف"""
+        if not self._tasks:
+            return
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+
+    async def _run(self):
+        while True:
+            media = await self.queue.get()
+            try:
+                await self._store(media)
+            # رابط تنزيل الملف يحمل توكن البوت (/file/bot<TOKEN>/...) ويظهر في نص أخطاء httpx،
+            # فلا يُسجل الخطأ نفسه ولا تتبعه
+            except httpx.HTTPStatusError as e:
+                logger.error(f"❌ تعذر تنزيل الملف {media.file_unique_id}: HTTP {e.response.status_code}")
+            except httpx.HTTPError as e:
+                logger.error(f"❌ تعذر تنزيل الملف {media.file_unique_id}: {type(e).__name__}")
+            except Exception:
+                logger.exception(f"تعذر تخزين الملف {media.file_unique_id}")
+            finally:
+                self.queue.task_done()
+
+    async def _store(self, media):
+        if await self.storage.attachment_path(media.file_unique_id):
+            return
+        if media.file_size and media.file_size > self.max_bytes:
+            logger.info(f"📎 الملف {media.file_unique_id} أكبر من حد التنزيل ({media.file_size} بايت)، يبقى في Telegram فقط")
+            return
+        file = await self.bot.get_file(media.file_id)
+        digest, tmp = await self._download(file.file_path)
+        relative = os.path.join(digest[:2], digest[2:4], digest)
+        target = os.path.join(self.root, relative)
+        if os.path.exists(target):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp, target)
+        await self.storage.set_attachment_path(media.file_unique_id, digest, relative)
+
+    async def _download(self, source):
+        """كتابة الملف قطعةً قطعة إلى ملف مؤقت مع حساب sha256 أثناء الكتابة؛ تعيد (البصمة، المسار المؤقت)"""
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                async for chunk in self._chunks(source):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ValueError(f"الملف تجاوز {self.max_bytes} بايت أثناء التنزيل")
+                    digest.update(chunk)
+                    await asyncio.to_thread(out.write, chunk)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return digest.hexdigest(), tmp
+
+    async def _chunks(self, source):
+        # خادم Bot API المحلي (--local) يعيد مساراً على القرص بدل رابط
+        if os.path.isabs(source):
+            with open(source, "rb") as f:
+                while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                    yield chunk
+            return
+        async with self._client.stream("GET", source) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                yield chunk
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""مقاييس خفيفة في الذاكرة (عدادات، مقاييس لحظية، توزيعات زمنية) تُعرض بصيغة Prometheus النصية"""
+
+import functools
+import logging
+import threading
+import time
+from http import HTTPStatus
+
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+
+from httpserver import HTTPServer, Response
+
+logger = logging.getLogger(__name__)
+
+# حدود التوزيع بالثواني: من استعلام SQLite سريع إلى طلب شبكة بطيء
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """أساس مشترك: الاسم والوصف وأسماء التصنيفات، والقيم في قاموس مفتاحه قيم التصنيفات.
+    التسجيل يحدث من حلقة الأحداث ومن خيوط قاعدة البيانات معاً، لذلك كل تعديل تحت قفل"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge(Metric):
+    """قيمة لحظية تُحسب عند القراءة: fn() تعيد رقماً، أو قاموساً {قيم التصنيفات: رقم}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            logger.exception(f"تعذر حساب المقياس {self.name}")
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        lines = []
+        for key, number in sorted(value.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {number}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # عدادات الحدود (غير تراكمية هنا)، ثم المجموع والعدد
+                series = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._values.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets, counts):
+                cumulative += hits
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"المقياس {metric.name} مسجل مسبقاً")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        """تسجيل مقياس لحظي، أو استبدال دالته إن كان مسجلاً (عند إعادة تشغيل التطبيق)"""
+        existing = self._metrics.get(name)
+        if isinstance(existing, Gauge):
+            existing.fn = fn
+            return existing
+        return self.register(Gauge(name, help, fn, labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            body = metric.render()
+            if body:
+                lines += metric.header() + body
+        return "\n".join(lines) + "\n"
+
+
+# ==================== مقاييس البوت ====================
+registry = Registry()
+
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds", "زمن معالجة التحديث لكل معالج", ["handler"])
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "استثناءات المعالجات حسب النوع", ["handler", "error"])
+ERRORS = registry.counter(
+    "bot_errors_total", "كل الأخطاء التي وصلت إلى معالج أخطاء التطبيق", ["error"])
+DB_SECONDS = registry.histogram(
+    "bot_db_seconds", "زمن تنفيذ عمليات SQLite داخل خيطها", ["kind", "op"])
+DB_WAIT_SECONDS = registry.histogram(
+    "bot_db_wait_seconds", "زمن انتظار العملية قبل أن يلتقطها خيط قاعدة البيانات", ["kind"])
+DB_ERRORS = registry.counter(
+    "bot_db_errors_total", "أخطاء SQLite حسب العملية", ["kind", "op", "error"])
+DB_SLOW = registry.counter(
+    "bot_db_slow_total", "العمليات التي تجاوزت حد الاستعلام البطيء", ["kind", "op"])
+API_SECONDS = registry.histogram(
+    "bot_telegram_api_seconds", "زمن طلبات Bot API الصادرة", ["method"])
+API_ERRORS = registry.counter(
+    "bot_telegram_api_errors_total", "طلبات Bot API الفاشلة حسب الطريقة ورمز الحالة أو الخطأ", ["method", "error"])
+DUPLICATE_UPDATES = registry.counter(
+    "bot_duplicate_updates_total", "تحديثات أعاد Telegram إرسالها بعد معالجتها فتم تجاهلها")
+NOTIFICATIONS_DROPPED = registry.counter(
+    "bot_admin_notifications_dropped_total", "إشعارات أدمن لم تُرسل قبل انتهاء مهلة الإيقاف")
+
+
+def instrumented(name):
+    """مزخرف لمعالجات PTB: يسجل الزمن في HANDLER_SECONDS والاستثناء في HANDLER_ERRORS ثم يعيد رفعه"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapped(update, context):
+            started = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception as e:
+                HANDLER_ERRORS.inc(name, type(e).__name__)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+        return wrapped
+    return decorator
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest يقيس زمن كل طلب صادر إلى Bot API حسب اسم الطريقة (sendMessage، editMessageText...)"""
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, body = await super().do_request(url, method, request_data, **timeouts)
+        except TelegramError as e:
+            API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if status >= 400:
+            API_ERRORS.inc(api_method, str(status))
+        return status, body
+
+
+# ==================== نقطة العرض ====================
+class MetricsServer:
+    """GET /metrics على خادم محلي منفصل عن webhook حتى لا يُكشف عبر الوكيل العكسي"""
+
+    def __init__(self, registry=registry, path="/metrics"):
+        self.registry = registry
+        self.http = HTTPServer({("GET", path): self.handle})
+
+    async def handle(self, request):
+        return Response(HTTPStatus.OK, self.registry.render(), CONTENT_TYPE)
+
+    async def start(self, host, port):
+        port = await self.http.start(host, port)
+        logger.info(f"📊 المقاييس متاحة على http://{host}:{port}/metrics")
+        return port
+
+    async def stop(self):
+        await self.http.stop()
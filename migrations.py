@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""ترحيلات مخطط قاعدة البيانات بأرقام إصدار متسلسلة، والإصدار المطبق محفوظ في schema_version"""
+
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# table: الجدول الذي تنشئه الترحيلة، وbackfill تعبئته من السجلات الموجودة، تُنفذ فقط إن لم يكن الجدول
+# موجوداً قبلها. بهذا تبقى كل ترحيلة آمنة لإعادة التنفيذ، ومنها تبني قواعد ما قبل schema_version إصدارها
+Migration = namedtuple("Migration", "version name statements table backfill", defaults=(None, ()))
+
+# فهرسة الرسائل الموجودة لمرة واحدة عند إنشاء messages_fts
+FTS_BACKFILL = "INSERT INTO messages_fts (rowid, body) SELECT id, ar_norm(message_text) FROM messages"
+
+# تعبئة الإحصاءات لمرة واحدة من السجلات الموجودة عند الترقية (تاريخ تسجيل المستخدم غير محفوظ،
+# فيُقدَّر بتاريخ أول رسالة أو حجز له، أو بآخر ظهور لمن اكتفى بالأزرار)
+STATS_BACKFILL = [
+    '''INSERT INTO daily_stats (day, metric, key, value)
+       SELECT substr(created_at, 1, 10), 'messages', COALESCE(message_type, ''), COUNT(*)
+       FROM messages WHERE created_at IS NOT NULL GROUP BY 1, 3''',
+    '''INSERT INTO daily_stats (day, metric, key, value)
+       SELECT substr(created_at, 1, 10), 'bookings', COALESCE(time, ''), COUNT(*)
+       FROM bookings WHERE created_at IS NOT NULL GROUP BY 1, 3''',
+    '''INSERT INTO daily_stats (day, metric, key, value)
+       SELECT day, 'new_users', '', COUNT(*) FROM (
+           SELECT user_id, substr(MIN(created_at), 1, 10) AS day FROM (
+               SELECT user_id, created_at FROM messages UNION ALL SELECT user_id, created_at FROM bookings
+               UNION ALL SELECT user_id, last_message FROM users
+           ) WHERE created_at IS NOT NULL GROUP BY user_id
+       ) GROUP BY day''',
+    # العدد الكلي للمستخدمين في صف بلا يوم، يزيده trg_stats_new_users بعدها فلا يُعدّ جدول users في كل عرض
+    '''INSERT INTO daily_stats (day, metric, key, value) SELECT '', 'total_users', '', COUNT(*) FROM users''',
+    # المشغل trg_stats_active يعدّ النشطين من هذه الصفوف
+    '''INSERT OR IGNORE INTO daily_active (day, user_id)
+       SELECT DISTINCT substr(created_at, 1, 10), user_id FROM messages WHERE created_at IS NOT NULL
+       UNION SELECT substr(last_message, 1, 10), user_id FROM users WHERE last_message IS NOT NULL''',
+]
+
+MIGRATIONS = [
+    Migration(1, "الجداول الأساسية: المستخدمون والحجوزات والرسائل", [
+        '''CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            state TEXT,
+            last_message TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT,
+            phone TEXT,
+            date TEXT,
+            time TEXT,
+            created_at TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            message_text TEXT,
+            message_type TEXT,
+            created_at TIMESTAMP
+        )''',
+    ]),
+    Migration(2, "فهارس عروض الأدمن", [
+        # فهارس عروض الأدمن: كل فهرس ثانوي يحمل rowid ضمنياً، فالتصفية مع الترقيم على id تبقى مسحاً لمدى ضيق
+        "CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_type ON messages(message_type)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_created_at ON bookings(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings(date)",
+    ]),
+    Migration(3, "مواعيد الحجز", [
+        # مواعيد الحجز (slots.py): taken يشمل الحجوزات المؤكدة والمؤقتة، وقيد CHECK يمنع تجاوز السعة
+        '''CREATE TABLE IF NOT EXISTS slots (
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            capacity INTEGER NOT NULL,
+            taken INTEGER NOT NULL DEFAULT 0 CHECK (taken >= 0 AND taken <= capacity),
+            PRIMARY KEY (date, time)
+        ) WITHOUT ROWID''',
+        # حجز مؤقت واحد لكل مستخدم أثناء إدخال الاسم ورقم الهاتف
+        '''CREATE TABLE IF NOT EXISTS slot_holds (
+            user_id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_slot_holds_expires ON slot_holds(expires_at)",
+    ]),
+    Migration(4, "الإحصاءات اليومية", [
+        # إحصاءات يومية تحدّثها المشغلات (triggers) مع كل إدخال، فلوحة الأدمن تقرأ صفوفاً جاهزة
+        # metric: new_users | active_users | messages (key = النوع) | bookings (key = وقت الموعد)،
+        # وtotal_users صف واحد بيوم فارغ ('') لا يظهر في قراءة الأيام
+        '''CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            key TEXT NOT NULL DEFAULT '',
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric, key)
+        ) WITHOUT ROWID''',
+        # من ظهر في كل يوم، لعدّ النشطين مرة واحدة لكل مستخدم (تُحذف الأيام القديمة في retention.py)
+        '''CREATE TABLE IF NOT EXISTS daily_active (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID''',
+        # المرسلون نشطون في يوم رسالتهم (الرسائل لا تحدّث users.last_message)، كما في تعبئة الإحصاءات
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_messages AFTER INSERT ON messages BEGIN
+            INSERT INTO daily_stats (day, metric, key, value)
+            VALUES (substr(NEW.created_at, 1, 10), 'messages', COALESCE(NEW.message_type, ''), 1)
+            ON CONFLICT(day, metric, key) DO UPDATE SET value = value + 1;
+            INSERT INTO daily_active (day, user_id) VALUES (substr(NEW.created_at, 1, 10), NEW.user_id)
+            ON CONFLICT(day, user_id) DO NOTHING;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_bookings AFTER INSERT ON bookings BEGIN
+            INSERT INTO daily_stats (day, metric, key, value)
+            VALUES (substr(NEW.created_at, 1, 10), 'bookings', COALESCE(NEW.time, ''), 1)
+            ON CONFLICT(day, metric, key) DO UPDATE SET value = value + 1;
+        END''',
+        # UPSERT على users يطلق مشغل INSERT فقط عند إضافة صف جديد فعلاً
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_new_users AFTER INSERT ON users BEGIN
+            INSERT INTO daily_stats (day, metric, key, value)
+            VALUES (substr(COALESCE(NEW.last_message, datetime('now', 'localtime')), 1, 10), 'new_users', '', 1)
+            ON CONFLICT(day, metric, key) DO UPDATE SET value = value + 1;
+            INSERT INTO daily_stats (day, metric, key, value) VALUES ('', 'total_users', '', 1)
+            ON CONFLICT(day, metric, key) DO UPDATE SET value = value + 1;
+            INSERT INTO daily_active (day, user_id)
+            VALUES (substr(COALESCE(NEW.last_message, datetime('now', 'localtime')), 1, 10), NEW.user_id)
+            ON CONFLICT(day, user_id) DO NOTHING;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_seen AFTER UPDATE OF last_message ON users
+        WHEN NEW.last_message IS NOT NULL BEGIN
+            -- لا INSERT OR IGNORE هنا: سياسة التعارض في الجملة الخارجية (UPSERT على users) تتغلب عليها
+            INSERT INTO daily_active (day, user_id) VALUES (substr(NEW.last_message, 1, 10), NEW.user_id)
+            ON CONFLICT(day, user_id) DO NOTHING;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_active AFTER INSERT ON daily_active BEGIN
+            INSERT INTO daily_stats (day, metric, key, value) VALUES (NEW.day, 'active_users', '', 1)
+            ON CONFLICT(day, metric, key) DO UPDATE SET value = value + 1;
+        END''',
+    ], table="daily_stats", backfill=STATS_BACKFILL),
+    Migration(5, "الصور والملفات", [
+        # الصور والملفات المرسلة من المستخدمين (media.py): صف واحد لكل ملف فريد مهما تكرر إرساله،
+        # وpath مساره في المخزن المعنون بالمحتوى إن نُزّل
+        '''CREATE TABLE IF NOT EXISTS attachments (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            file_name TEXT,
+            mime_type TEXT,
+            file_size INTEGER,
+            sha256 TEXT,
+            path TEXT,
+            created_at TIMESTAMP
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS message_attachments (
+            message_id INTEGER NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            PRIMARY KEY (message_id, file_unique_id)
+        ) WITHOUT ROWID''',
+    ]),
+    Migration(6, "البحث النصي في الرسائل", [
+        # فهرس البحث النصي في الرسائل (search.py): بلا محتوى مخزن (content='') لأنه يفهرس النص بعد التطبيع،
+        # والنص الأصلي يُقرأ من messages بنفس rowid. ar_norm دالة مسجلة على كل اتصال في Storage
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            body, content='', tokenize='unicode61 remove_diacritics 2'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, body) VALUES (NEW.id, ar_norm(NEW.message_text));
+        END''',
+        # الجدول بلا محتوى، فالحذف يحتاج النص المفهرس نفسه
+        '''CREATE TRIGGER IF NOT EXISTS trg_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', OLD.id, ar_norm(OLD.message_text));
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_fts_update AFTER UPDATE OF message_text ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', OLD.id, ar_norm(OLD.message_text));
+            INSERT INTO messages_fts (rowid, body) VALUES (NEW.id, ar_norm(NEW.message_text));
+        END''',
+    ], table="messages_fts", backfill=[FTS_BACKFILL]),
+    Migration(7, "طابور الطلبات", [
+        # طابور الطلبات (triage.py): الفهرس يغطي عرض المفتوح حسب النوع بترتيب الأقدم وفحص المهلة
+        '''CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            summary TEXT,
+            status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'answered', 'closed')),
+            sla_level INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL,
+            answered_at TIMESTAMP
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_requests_triage ON requests(status, type, created_at)",
+        # رسالة الإشعار في محادثة الأدمن -> صاحبها، للرد عليه بالرد على الإشعار؛ created_at لحذف القديم (retention.py)
+        '''CREATE TABLE IF NOT EXISTS admin_links (
+            admin_message_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            request_id INTEGER,
+            created_at TIMESTAMP
+        )''',
+    ]),
+    Migration(8, "المهام المجدولة والبث", [
+        # المهام المجدولة (scheduler.py): payload معاملات JSON، والفهرس لقراءة المستحق بترتيب الوقت
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            run_at TIMESTAMP NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, run_at)",
+        # البث الجماعي: cursor آخر user_id وصلته الرسالة (الاستئناف بعد إعادة التشغيل يبدأ بعده)
+        '''CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'cancelled')),
+            total INTEGER NOT NULL DEFAULT 0,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )''',
+        # من حظر البوت (Forbidden عند الإرسال)؛ يُحذف إن عاد وأرسل /start
+        '''CREATE TABLE IF NOT EXISTS blocked_users (
+            user_id INTEGER PRIMARY KEY,
+            blocked_at TIMESTAMP
+        )''',
+    ]),
+    # update_id لكل تحديث عولج، حتى لا يُعالج مرة ثانية إن أعاد Telegram إرساله بعد إعادة التشغيل
+    Migration(9, "التحديثات المعالجة", [
+        '''CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            processed_at TIMESTAMP NOT NULL
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates(processed_at)",
+    ]),
+]
+
+# الترحيلات الجديدة تُضاف في آخر MIGRATIONS برقم أكبر، ولا تُعدَّل ترحيلة سبق تطبيقها
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMP)"
+    )
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn):
+    """تطبيق الترحيلات الأحدث من الإصدار الحالي، كل ترحيلة في معاملة مستقلة؛ تعيد عدد المطبق منها.
+    عند اكتمال الإصدار يكفي استعلام واحد، فلا يتأخر تشغيل البوت"""
+    version = current_version(conn)
+    applied = 0
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        conn.execute("BEGIN")
+        try:
+            existed = migration.table and conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name=?", (migration.table,)
+            ).fetchone()
+            for statement in migration.statements:
+                conn.execute(statement)
+            if not existed:
+                for statement in migration.backfill:
+                    conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (migration.version, migration.name, datetime.now())
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logger.info(f"🧱 ترحيل قاعدة البيانات إلى الإصدار {migration.version}: {migration.name}")
+        applied += 1
+    return applied
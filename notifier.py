@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""طابور إشعارات الأدمن: إرسال في الخلفية مع احترام حدود Telegram ودمج الرسائل وقت الضغط"""
+
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+
+# media: (kind, file_id) لإرسال ملف المستخدم نفسه بمعرّفه دون تنزيل وإعادة رفع
+# link: (user_id, request_id) صاحب الإشعار، يُمرَّر إلى on_sent مع معرّف الرسالة المرسلة
+Notification = namedtuple("Notification", "category text media link", defaults=(None, None))
+
+# عناوين الملخص لكل نوع إشعار
+DIGEST_TITLES = {
+    "message": "📩 رسائل جديدة",
+    "inquiry": "📝 استفسارات جديدة",
+    "diet_edit": "🔄 طلبات تعديل نظام غذائي",
+    "analysis": "🔬 طلبات شرح تحليل",
+    "medical_diet": "🏥 طلبات برنامج غذائي طبي",
+    "daily_followup": "📆 طلبات متابعة يومية",
+    "booking": "📅 حجوزات جديدة",
+    "sla": "⏰ تنبيهات مهلة الرد",
+    "broadcast": "📣 البث الجماعي",
+}
+
+
+def retry_delay(error):
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """تقسيم النص الطويل على حدود الأسطر ليناسب حد رسالة Telegram"""
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class AdminNotifier:
+    """المعالجات تضع الإشعار في الطابور وتكمل فوراً، والمرسل في الخلفية يتكفل بالباقي"""
+
+    def __init__(self, chat_id, rate=1.0, burst=3, digest_threshold=5, max_backoff=60, on_sent=None,
+                 drain_timeout=15):
+        self.chat_id = chat_id
+        # async on_sent(message_id, link) بعد إرسال كل إشعار منفرد يحمل link (الملخصات لا تُربط)
+        self.on_sent = on_sent
+        self.bucket = TokenBucket(rate, burst)
+        self.digest_threshold = digest_threshold
+        self.max_backoff = max_backoff
+        # أقصى انتظار لتفريغ الطابور عند الإيقاف: _send يعيد المحاولة بلا حد أثناء انقطاع الشبكة
+        self.drain_timeout = drain_timeout
+        self.queue = asyncio.Queue()
+        self.bot = None
+        self._batch = []
+        self._task = None
+
+    def notify(self, category, text, media=None, link=None):
+        if self.chat_id:
+            self.queue.put_nowait(Notification(category, text, media, link))
+
+    def start(self, bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """إرسال ما تبقى في الطابور قبل الإيقاف، خلال drain_timeout ثانية على الأكثر"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            dropped = len(self._batch) + self.queue.qsize()
+            metrics.NOTIFICATIONS_DROPPED.inc(amount=dropped)
+            logger.error(f"❌ لم يكتمل إرسال إشعارات الأدمن خلال {self.drain_timeout} ثانية، فُقد {dropped} إشعار")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # ما بقي في الطابور سُجّل مفقوداً، فلا يُرسل متأخراً عند التشغيل التالي
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+
+    async def _run(self):
+        while True:
+            self._batch = batch = [await self.queue.get()]
+            # عند تراكم الطابور تُدمج كل الإشعارات المنتظرة في ملخص واحد لكل نوع
+            if self.queue.qsize() + 1 >= self.digest_threshold:
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+            try:
+                for text, media, link in self._render(batch):
+                    message = await self._send(text, media)
+                    if message is not None and link and self.on_sent:
+                        await self._linked(message.message_id, link)
+            except Exception:
+                logger.exception("فشل إرسال إشعار الأدمن")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+                self._batch = []
+
+    async def _linked(self, message_id, link):
+        # فشل الربط لا يوقف إرسال بقية الإشعارات
+        try:
+            await self.on_sent(message_id, link)
+        except Exception:
+            logger.exception(f"تعذر ربط إشعار الأدمن {message_id} بصاحبه")
+
+    def _render(self, batch):
+        """[(نص، ملف، ربط)] بترتيب الإرسال: الملفات لا تُدمج في الملخص، بل تُرسل كلٌ مع تعليقه"""
+        texts = [item for item in batch if item.media is None]
+        outgoing = []
+        if len(texts) == 1:
+            outgoing += [(chunk, None, texts[0].link) for chunk in split_text(texts[0].text)]
+        elif texts:
+            groups = {}
+            for item in texts:
+                groups.setdefault(item.category, []).append(item.text)
+            for category, items in groups.items():
+                title = DIGEST_TITLES.get(category, category)
+                chunks = split_text(f"{title} ({len(items)}):\n\n" + "\n\n➖➖➖\n\n".join(items))
+                outgoing += [(chunk, None, None) for chunk in chunks]
+        for item in batch:
+            if item.media is None:
+                continue
+            if len(item.text) <= MAX_CAPTION_LENGTH:
+                outgoing.append((item.text, item.media, item.link))
+            else:
+                outgoing.append(("", item.media, item.link))
+                outgoing += [(chunk, None, item.link) for chunk in split_text(item.text)]
+        return outgoing
+
+    def _call(self, text, media):
+        if media is None:
+            return self.bot.send_message(self.chat_id, text)
+        kind, file_id = media
+        caption = text or None
+        if kind == "photo":
+            return self.bot.send_photo(self.chat_id, file_id, caption=caption)
+        return self.bot.send_document(self.chat_id, file_id, caption=caption)
+
+    async def _send(self, text, media=None):
+        backoff = 1
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await self._call(text, media)
+            except RetryAfter as e:
+                delay = retry_delay(e)
+                logger.warning(f"⏳ Telegram طلب الانتظار {delay} ثانية قبل إشعار الأدمن التالي")
+                self.bucket.penalize(delay)
+            except (BadRequest, Forbidden) as e:
+                # أخطاء لن تُحل بإعادة المحاولة
+                logger.error(f"❌ تعذر إرسال إشعار الأدمن: {e}\n{text}")
+                return None
+            except NetworkError as e:
+                logger.warning(f"⚠️ خطأ شبكة أثناء إشعار الأدمن، إعادة المحاولة بعد {backoff} ثانية: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""تحديد معدل الإرسال إلى Telegram"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """دلو رموز: rate رمز في الثانية وسعة capacity للدفعات القصيرة"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # القفل يحافظ على ترتيب المنتظرين فلا يسبق أحدهم الآخر
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """تصفير الدلو لمدة retry_after التي يطلبها Telegram"""
+        self._refill()
+        self._tokens = -seconds * self.rate
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""أرشفة السجلات القديمة إلى ملفات JSONL مضغوطة مقسمة حسب الشهر، والتصدير المتدفق لنطاق تاريخ"""
+
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# الأعمدة المؤرشفة والمصدّرة لكل جدول، بالترتيب
+COLUMNS = {
+    "messages": ("id", "user_id", "username", "message_text", "message_type", "created_at"),
+    "bookings": ("id", "user_id", "name", "phone", "date", "time", "created_at"),
+}
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def _partition(created_at):
+    """مفتاح الشهر "2026-09" من created_at، و"unknown" للقيم الفارغة أو غير القياسية"""
+    value = str(created_at or "")
+    return value[:7] if len(value) >= 7 and value[4] == "-" else "unknown"
+
+
+def _append_archive(path, rows):
+    """إلحاق الصفوف كعضو gzip جديد ثم fsync قبل أن تُحذف من القاعدة.
+    الملف متعدد الأعضاء يُقرأ كملف واحد بـ zcat أو gzip.open"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def write_export(conn, table, start, end, fmt, path, batch=500):
+    """كتابة صفوف created_at في [start, end) إلى path من المؤشر مباشرة دفعةً دفعة؛ تعيد عدد الصفوف"""
+    columns = COLUMNS[table]
+    cursor = conn.execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE created_at >= ? AND created_at < ? ORDER BY id",
+        (start, end)
+    )
+    count = 0
+    # utf-8-sig حتى يعرض Excel النص العربي في CSV بشكل صحيح
+    with open(path, "w", encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+class RetentionJob:
+    """كل interval ثانية: نقل الصفوف الأقدم من حد الاحتفاظ إلى الأرشيف على دفعات، ثم تحرير الصفحات
+    الفارغة بـ incremental_vacuum. كل دفعة معاملة قصيرة مستقلة على الكاتب فلا تحجب كتابات البوت طويلاً.
+    الأيام = 0 تعني الاحتفاظ بلا حد"""
+
+    def __init__(self, storage, archive_dir, messages_days=180, general_days=30, bookings_days=365,
+                 active_days=60, links_days=30, batch=1000, vacuum_pages=500, interval=24 * 3600):
+        self.storage = storage
+        self.archive_dir = archive_dir
+        self.messages_days = messages_days
+        self.general_days = general_days
+        self.bookings_days = bookings_days
+        # daily_active يلزم فقط لعدّ النشطين في نافذة عرض الإحصاءات الأسبوعية
+        self.active_days = active_days
+        # ربط إشعارات الأدمن بأصحابها: الرد على إشعار أقدم يبقى ممكناً بـ /reply رقم_الطلب
+        self.links_days = links_days
+        self.batch = batch
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self._task = None
+
+    @staticmethod
+    def _cutoff(days, now):
+        return now - timedelta(days=days) if days else None
+
+    def cutoff(self, table, now=None):
+        """أقدم تاريخ تبقى سجلات الجدول بعده كاملة في القاعدة، أو None إن لم يكن للجدول حد احتفاظ"""
+        days = [self.general_days, self.messages_days] if table == "messages" else [self.bookings_days]
+        days = [d for d in days if d]
+        return self._cutoff(min(days), now or datetime.now()) if days else None
+
+    def _selections(self, now):
+        """[(الجدول، شرط WHERE، المعاملات)] لكل ما انتهت مدة الاحتفاظ به"""
+        selections = []
+        conditions, params = [], []
+        # الدردشة العامة (general) مدتها أقصر من الطلبات المصنفة
+        for days, condition in ((self.general_days, "message_type='general' AND created_at < ?"),
+                                (self.messages_days, "created_at < ?")):
+            cutoff = self._cutoff(days, now)
+            if cutoff:
+                conditions.append(f"({condition})")
+                params.append(cutoff)
+        if conditions:
+            selections.append(("messages", " OR ".join(conditions), params))
+        cutoff = self._cutoff(self.bookings_days, now)
+        if cutoff:
+            # لا يُؤرشف حجز موعده لم يأتِ بعد مهما كان قديم الإنشاء. الحجوزات القديمة تحفظ اسم اليوم ("الأحد")
+            # لا تاريخاً، وهو نص يأتي بعد كل التواريخ في الترتيب، فيكفي لها created_at وحده
+            selections.append((
+                "bookings",
+                "created_at < ? AND (date < ? OR date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]')",
+                [cutoff, now.date().isoformat()]
+            ))
+        return selections
+
+    async def _archive_batch(self, table, where, params):
+        columns = COLUMNS[table]
+        rows = await self.storage.read(
+            lambda conn: conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE {where} ORDER BY id LIMIT ?", (*params, self.batch)
+            ).fetchall(),
+            op=f"retention.select_{table}"
+        )
+        if not rows:
+            return 0
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(_partition(row[-1]), []).append(dict(zip(columns, row)))
+
+        def write_files():
+            for month, records in partitions.items():
+                _append_archive(os.path.join(self.archive_dir, table, f"{month}.jsonl.gz"), records)
+        # الحذف بعد fsync فقط: الانقطاع بينهما قد يكرر صفوفاً في الأرشيف لكنه لا يفقد شيئاً
+        await asyncio.to_thread(write_files)
+        ids = [(row[0],) for row in rows]
+
+        def delete(conn):
+            conn.executemany(f"DELETE FROM {table} WHERE id=?", ids)
+            if table == "messages":
+                # روابط الملفات تُحذف مع رسائلها، أما صفوف attachments وملفات MEDIA_DIR فتبقى
+                conn.executemany("DELETE FROM message_attachments WHERE message_id=?", ids)
+        await self.storage.write(delete, op=f"retention.delete_{table}")
+        return len(rows)
+
+    async def vacuum(self):
+        """تحرير الصفحات الفارغة على دفعات صغيرة حتى تتخلل كتابات البوت بينها"""
+        def step(conn):
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        freed = 0
+        while True:
+            pages = await self.storage.write(step, op="retention.vacuum")
+            # صفر يعني لا صفحات فارغة، أو أن القاعدة ليست بوضع auto_vacuum=INCREMENTAL
+            if not pages:
+                return freed
+            freed += pages
+
+    async def run(self, now=None):
+        """دورة كاملة؛ تعيد {الجدول: عدد الصفوف المؤرشفة}"""
+        now = now or datetime.now()
+        archived = {}
+        for table, where, params in self._selections(now):
+            total = 0
+            while True:
+                count = await self._archive_batch(table, where, params)
+                total += count
+                if count < self.batch:
+                    break
+            archived[table] = total
+        # صفوف المواعيد الماضية لم تعد تُعرض ولا تُحجز
+        await self.storage.execute("DELETE FROM slots WHERE date < ?", (now.date().isoformat(),))
+        # الأعداد اليومية في daily_stats تبقى كما هي، أما من ظهر في كل يوم فلا حاجة له بعد active_days
+        if self.active_days:
+            await self.storage.execute(
+                "DELETE FROM daily_active WHERE day < ?", ((now.date() - timedelta(days=self.active_days)).isoformat(),)
+            )
+        if self.links_days:
+            await self.storage.execute(
+                "DELETE FROM admin_links WHERE created_at < ?", (now - timedelta(days=self.links_days),)
+            )
+        # Telegram لا يحتفظ بالتحديثات غير المستلمة أكثر من 24 ساعة، فلا يعيد إرسال ما هو أقدم
+        await self.storage.execute("DELETE FROM processed_updates WHERE processed_at < ?", (now - timedelta(days=2),))
+        freed = await self.vacuum()
+        await self.storage.write(lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall(),
+                                 op="retention.checkpoint")
+        if any(archived.values()) or freed:
+            logger.info(f"🗄️ الأرشفة: {archived} وتحرير {freed} صفحة")
+        return archived
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("تعذرت أرشفة السجلات القديمة")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""موجّه أزرار callback: تسجيل المسارات مرة واحدة والتوجيه بقاموس بدل سلسلة if/elif"""
+
+import logging
+import re
+import time
+
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackRouter:
+    """المسار إما نص كامل ("faq") أو بادئة يتبعها معاملات مفصولة بـ ":" ("faq:2")
+    أو تعبير نمطي كحل أخير. كل مسار يحمل سلسلة middleware خاصة به تُركَّب عند التسجيل"""
+
+    def __init__(self, separator=":", middleware=()):
+        self.separator = separator
+        self.middleware = list(middleware)
+        self._exact = {}
+        self._prefixes = {}
+        self._patterns = []
+
+    def _wrap(self, handler, middleware):
+        call = handler
+        for mw in reversed([*self.middleware, *middleware]):
+            call = _bind(mw, call)
+        return call
+
+    def route(self, name, *, prefix=False, middleware=()):
+        """تسجيل معالج: handler(query, context, *args)، والمعاملات هي ما بعد البادئة"""
+        def decorator(handler):
+            table = self._prefixes if prefix else self._exact
+            if name in table:
+                raise ValueError(f"المسار {name} مسجل مسبقاً")
+            table[name] = self._wrap(handler, middleware)
+            return handler
+        return decorator
+
+    def pattern(self, regex, *, middleware=()):
+        """تسجيل معالج لتعبير نمطي، ومعاملاته هي مجموعات التطابق"""
+        def decorator(handler):
+            self._patterns.append((re.compile(regex), self._wrap(handler, middleware)))
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        call = self._exact.get(data)
+        if call is not None:
+            return call, ()
+        head, sep, rest = data.partition(self.separator)
+        if sep:
+            call = self._prefixes.get(head)
+            if call is not None:
+                return call, tuple(rest.split(self.separator))
+        for regex, call in self._patterns:
+            match = regex.fullmatch(data)
+            if match:
+                return call, match.groups()
+        return None, ()
+
+    async def dispatch(self, update, context):
+        """المعالج الوحيد المسجل كـ CallbackQueryHandler"""
+        query = update.callback_query
+        await query.answer()
+        call, args = self.resolve(query.data or "")
+        if call is None:
+            logger.warning(f"زر غير معروف: {query.data!r}")
+            return
+        await call(query, context, *args)
+
+
+def _bind(mw, call):
+    async def wrapped(query, context, *args):
+        return await mw(query, context, call, *args)
+    return wrapped
+
+
+# ==================== middleware ====================
+# التوقيع: mw(query, context, call_next, *args)
+
+def require_admin(admin_id):
+    """تجاهل الزر إن لم يضغطه الأدمن"""
+    async def mw(query, context, call_next, *args):
+        if query.from_user.id != admin_id:
+            return None
+        return await call_next(query, context, *args)
+    return mw
+
+
+def track_last_seen(storage):
+    """تسجيل آخر ظهور للمستخدم، للأزرار التي تمثل تفاعلاً فعلياً لا مجرد تنقل"""
+    async def mw(query, context, call_next, *args):
+        storage.update_last_message(query.from_user.id)
+        return await call_next(query, context, *args)
+    return mw
+
+
+def timed(slow_ms=500, separator=":"):
+    """قياس زمن المعالج في HANDLER_SECONDS وعدّ استثناءاته وتسجيل البطيء منه.
+    التصنيف هو اسم المسار دون معاملاته ("faq:2" -> "button:faq") حتى يبقى عدد السلاسل محدوداً"""
+    async def mw(query, context, call_next, *args):
+        name = f"button:{(query.data or '').partition(separator)[0]}"
+        started = time.perf_counter()
+        try:
+            return await call_next(query, context, *args)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, name)
+            if elapsed * 1000 >= slow_ms:
+                logger.warning(f"🐢 الزر {query.data!r} استغرق {elapsed * 1000:.0f} ms")
+    return mw
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""مهام مجدولة محفوظة في القاعدة (تذكير المواعيد والبث الجماعي) تنجو من إعادة التشغيل،
+وإرسال للمستخدمين ضمن حدود Telegram العامة ولكل محادثة"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from notifier import retry_delay
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+
+
+class Sender:
+    """دلو رموز عام (Telegram يسمح بنحو 30 رسالة في الثانية لكل البوت، فيُترك هامش لردود المعالجات)
+    وفاصل أدنى بين رسالتين لنفس المحادثة (رسالة في الثانية)"""
+
+    def __init__(self, storage, rate=20, per_chat_interval=1.0, max_attempts=5):
+        self.storage = storage
+        self.bucket = TokenBucket(rate, rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.bot = None
+        self._last_sent = {}
+
+    def start(self, bot):
+        self.bot = bot
+
+    async def _chat_slot(self, chat_id):
+        now = time.monotonic()
+        wait = self._last_sent.get(chat_id, 0) + self.per_chat_interval - now
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_sent[chat_id] = time.monotonic()
+        if len(self._last_sent) > 10000:
+            # لا حاجة لتذكر محادثة مر على آخر رسالة لها أكثر من الفاصل
+            cutoff = time.monotonic() - self.per_chat_interval
+            self._last_sent = {chat: sent for chat, sent in self._last_sent.items() if sent > cutoff}
+
+    async def send(self, chat_id, text, **kwargs):
+        """إرسال مع إعادة المحاولة لأخطاء الشبكة وRetryAfter؛ يعيد SENT أو BLOCKED أو FAILED"""
+        backoff = 1
+        for _ in range(self.max_attempts):
+            await self._chat_slot(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return SENT
+            except RetryAfter as e:
+                self.bucket.penalize(retry_delay(e))
+            except Forbidden:
+                await self.storage.execute(
+                    "INSERT OR IGNORE INTO blocked_users (user_id, blocked_at) VALUES (?, ?)", (chat_id, datetime.now())
+                )
+                return BLOCKED
+            except BadRequest as e:
+                logger.warning(f"⚠️ تعذر الإرسال إلى {chat_id}: {e}")
+                return FAILED
+            except NetworkError as e:
+                logger.warning(f"⚠️ خطأ شبكة أثناء الإرسال إلى {chat_id}، إعادة المحاولة بعد {backoff} ثانية: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+        return FAILED
+
+    async def unblock(self, user_id):
+        """المستخدم عاد (/start) بعد أن حظر البوت"""
+        await self.storage.execute("DELETE FROM blocked_users WHERE user_id=?", (user_id,))
+
+
+class Scheduler:
+    """كل مهمة صف في jobs بنوع ووقت تنفيذ ومعاملات JSON. المهام المستحقة تُحجز (running) وتُنفذ
+    كمهام asyncio مستقلة، فالبث الطويل لا يؤخر التذكيرات. عند التشغيل تعود المهام التي انقطعت
+    أثناء التنفيذ إلى pending، فالتنفيذ مرة واحدة على الأقل"""
+
+    def __init__(self, storage, poll_interval=30, batch=50, max_attempts=3):
+        self.storage = storage
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._running = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def job(self, kind):
+        """تسجيل معالج نوع مهمة: async handler(payload)"""
+        def decorator(handler):
+            if kind in self._handlers:
+                raise ValueError(f"نوع المهمة {kind} مسجل مسبقاً")
+            self._handlers[kind] = handler
+            return handler
+        return decorator
+
+    async def schedule(self, kind, run_at, payload):
+        def run(conn):
+            return conn.execute(
+                "INSERT INTO jobs (kind, run_at, payload, created_at) VALUES (?, ?, ?, ?)",
+                (kind, run_at, json.dumps(payload, ensure_ascii=False), datetime.now())
+            ).lastrowid
+        job_id = await self.storage.write(run, op="jobs.schedule")
+        if run_at <= datetime.now() + timedelta(seconds=self.poll_interval):
+            self._wakeup.set()
+        return job_id
+
+    async def _claim(self):
+        now = datetime.now()
+
+        def run(conn):
+            rows = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE status='pending' AND run_at <= ? ORDER BY run_at LIMIT ?",
+                (now, self.batch)
+            ).fetchall()
+            conn.executemany("UPDATE jobs SET status='running' WHERE id=?", [(row[0],) for row in rows])
+            return rows
+        return await self.storage.write(run, op="jobs.claim")
+
+    async def _execute(self, job_id, kind, payload, attempts):
+        try:
+            await self._handlers[kind](json.loads(payload))
+        except asyncio.CancelledError:
+            # إيقاف البوت: تبقى running وتُستأنف عند التشغيل التالي
+            raise
+        except Exception:
+            logger.exception(f"فشلت المهمة {job_id} ({kind})")
+            attempts += 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            retry_at = datetime.now() + timedelta(minutes=5 * attempts)
+            await self.storage.execute(
+                "UPDATE jobs SET status=?, attempts=?, run_at=? WHERE id=?", (status, attempts, retry_at, job_id)
+            )
+        else:
+            await self.storage.execute("UPDATE jobs SET status='done' WHERE id=?", (job_id,))
+
+    async def _run(self):
+        await self.storage.execute("UPDATE jobs SET status='pending' WHERE status='running'")
+        while True:
+            try:
+                for job_id, kind, payload, attempts in await self._claim():
+                    if kind not in self._handlers:
+                        logger.error(f"نوع مهمة غير معروف: {kind}")
+                        continue
+                    task = asyncio.create_task(self._execute(job_id, kind, payload, attempts))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+            except Exception:
+                logger.exception("تعذر قراءة المهام المستحقة")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        tasks = [self._task, *self._running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+
+class Broadcasts:
+    """بث رسالة لكل المستخدمين غير الحاظرين للبوت. المستلمون يُقرؤون بترقيم keyset على user_id،
+    ويُحفظ آخر مستلم (cursor) مع العدادات بعد كل رسالة، فالبث المنقطع يكمل من حيث توقف دون تكرار"""
+
+    def __init__(self, storage, scheduler, sender, notifier, page_size=200):
+        self.storage = storage
+        self.scheduler = scheduler
+        self.sender = sender
+        self.notifier = notifier
+        self.page_size = page_size
+        scheduler.job("broadcast")(self._run)
+
+    async def create(self, text):
+        """إنشاء بث وجدولته فوراً؛ يعيد (المعرّف، عدد المستلمين)"""
+        def run(conn):
+            total = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE user_id NOT IN (SELECT user_id FROM blocked_users)"
+            ).fetchone()[0]
+            broadcast_id = conn.execute(
+                "INSERT INTO broadcasts (text, total, created_at) VALUES (?, ?, ?)", (text, total, datetime.now())
+            ).lastrowid
+            return broadcast_id, total
+        broadcast_id, total = await self.storage.write(run, op="broadcasts.create")
+        await self.scheduler.schedule("broadcast", datetime.now(), {"broadcast_id": broadcast_id})
+        return broadcast_id, total
+
+    async def cancel(self, broadcast_id):
+        def run(conn):
+            return conn.execute(
+                "UPDATE broadcasts SET status='cancelled', finished_at=? WHERE id=? AND status IN ('pending', 'running')",
+                (datetime.now(), broadcast_id)
+            ).rowcount == 1
+        return await self.storage.write(run, op="broadcasts.cancel")
+
+    async def recent(self, limit=5):
+        """(id، الحالة، الإجمالي، أُرسل، حظر، فشل، النص) لأحدث البثوث"""
+        return await self.storage.execute(
+            "SELECT id, status, total, sent, blocked, failed, text FROM broadcasts ORDER BY id DESC LIMIT ?",
+            (limit,), fetch=True
+        )
+
+    async def _state(self, broadcast_id):
+        res = await self.storage.execute(
+            "SELECT text, status, cursor FROM broadcasts WHERE id=?", (broadcast_id,), fetch=True
+        )
+        return res[0] if res else None
+
+    async def _run(self, payload):
+        broadcast_id = payload["broadcast_id"]
+        state = await self._state(broadcast_id)
+        if not state or state[1] in ("done", "cancelled"):
+            return
+        text, _, cursor = state
+        await self.storage.execute(
+            "UPDATE broadcasts SET status='running', started_at=COALESCE(started_at, ?) WHERE id=?",
+            (datetime.now(), broadcast_id)
+        )
+        while True:
+            recipients = await self.storage.execute(
+                """SELECT user_id FROM users WHERE user_id > ?
+                   AND user_id NOT IN (SELECT user_id FROM blocked_users) ORDER BY user_id LIMIT ?""",
+                (cursor, self.page_size), fetch=True
+            )
+            if not recipients:
+                break
+            # الإلغاء يُفحص مرة لكل صفحة
+            if (await self._state(broadcast_id))[1] == "cancelled":
+                return
+            for (user_id,) in recipients:
+                result = await self.sender.send(user_id, text)
+                cursor = user_id
+                await self.storage.execute(
+                    f"UPDATE broadcasts SET cursor=?, {result}={result} + 1 WHERE id=?", (cursor, broadcast_id)
+                )
+        def finish(conn):
+            conn.execute(
+                "UPDATE broadcasts SET status='done', finished_at=? WHERE id=? AND status='running'",
+                (datetime.now(), broadcast_id)
+            )
+            return conn.execute(
+                "SELECT status, sent, blocked, failed FROM broadcasts WHERE id=?", (broadcast_id,)
+            ).fetchone()
+        status, sent, blocked, failed = await self.storage.write(finish, op="broadcasts.finish")
+        if status == "done":
+            self.notifier.notify("broadcast", f"📣 اكتمل البث #{broadcast_id}: أُرسل {sent}، حظروا البوت {blocked}، فشل {failed}")
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""تطبيع النص العربي للبحث: نفس الدالة تُطبَّق على النص عند الفهرسة وعلى كلمات البحث"""
+
+import re
+
+# التشكيل (الفتحة ... السكون والألف الخنجرية) والتطويل
+_DIACRITICS = re.compile("[\u064B-\u0652\u0670\u0640]")
+_FOLD = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+})
+# "ال" في أول الكلمة (البروبيوتيك) إن بقيت بعدها 3 حروف. حروف العطف والجر قبلها لا تُحذف (والدتي، كالسيوم).
+# التكرار يجعل الدالة ثابتة عند إعادة تطبيقها: الالتهاب والتهاب كلاهما "تهاب"
+_ARTICLE = re.compile(r"\b(?:ال)+(?=\w{3})")
+_TERMS = re.compile(r"\w+")
+
+
+def normalize(text):
+    """طي أشكال الألف والياء والتاء المربوطة وحذف التشكيل وأداة التعريف، مع تصغير الحروف اللاتينية"""
+    if not text:
+        return ""
+    return _ARTICLE.sub("", _DIACRITICS.sub("", text).translate(_FOLD)).lower()
+
+
+def match_query(text):
+    """تحويل كلمات المستخدم إلى استعلام FTS5 آمن: كل كلمة بادئة ("بروبيوتيك"*) وكلها مطلوبة.
+    يعيد None إن لم يبقَ شيء يُبحث عنه"""
+    terms = _TERMS.findall(normalize(text))
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""توزيع التحديثات على أجزاء حسب المستخدم: تحديثات المستخدم الواحد بالترتيب، والمستخدمون المختلفون بالتوازي"""
+
+import asyncio
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_key(update):
+    """مفتاح التوزيع: معرّف المستخدم، أو المحادثة إن لم يوجد مستخدم"""
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat is not None else 0
+
+
+class ShardedUpdateProcessor(BaseUpdateProcessor):
+    """كل جزء طابور يعالجه عامل واحد بالتسلسل، فحالة محادثة المستخدم (قراءة ثم كتابة) لا تتداخل.
+    max_pending حد التحديثات المنتظرة في كل الأجزاء معاً قبل أن يتوقف الاستلام"""
+
+    def __init__(self, shards=8, max_pending=1024, warn_depth=50):
+        super().__init__(max_pending)
+        self.shards = shards
+        self.warn_depth = warn_depth
+        self._queues = []
+        self._workers = []
+        self.processed = [0] * shards
+        self.peak_depth = [0] * shards
+
+    async def initialize(self):
+        self._queues = [asyncio.Queue() for _ in range(self.shards)]
+        self._workers = [asyncio.create_task(self._work(i)) for i in range(self.shards)]
+
+    async def shutdown(self):
+        # العلامة None تأتي بعد آخر تحديث في كل طابور، فيكمل العامل ما قبلها ثم يتوقف
+        for queue in self._queues:
+            queue.put_nowait(None)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def do_process_update(self, update, coroutine):
+        shard = update_key(update) % self.shards
+        queue = self._queues[shard]
+        done = asyncio.get_running_loop().create_future()
+        queue.put_nowait((coroutine, done))
+        depth = queue.qsize()
+        if depth > self.peak_depth[shard]:
+            self.peak_depth[shard] = depth
+        if depth == self.warn_depth:
+            # تحذير واحد عند تجاوز الحد صعوداً، لا مع كل تحديث بعده
+            logger.warning(f"📈 طابور الجزء {shard} وصل إلى {depth} تحديث")
+        await done
+
+    async def _work(self, shard):
+        queue = self._queues[shard]
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            coroutine, done = item
+            try:
+                await coroutine
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+            finally:
+                self.processed[shard] += 1
+
+    def depths(self):
+        """عمق طابور كل جزء الآن"""
+        return [queue.qsize() for queue in self._queues]
+
+    def stats(self):
+        return [
+            {"shard": i, "depth": depth, "peak": self.peak_depth[i], "processed": self.processed[i]}
+            for i, depth in enumerate(self.depths())
+        ]
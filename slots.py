@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""محرك مواعيد الحجز: أيام وأوقات حقيقية بسعة محددة، حجز مؤقت أثناء إدخال البيانات، وذاكرة للمتاح"""
+
+import asyncio
+import logging
+import time as clock
+from datetime import date as Date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+WEEKDAY_NAMES = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+
+
+def time_key(time):
+    """الوقت بدون ":" ليصلح داخل callback_data المفصولة بـ ":" (13:00 -> 1300)"""
+    return time.replace(":", "")
+
+
+def time_from_key(key):
+    return f"{key[:2]}:{key[2:]}"
+
+
+def _release(conn, date, time):
+    conn.execute("UPDATE slots SET taken = taken - 1 WHERE date=? AND time=?", (date, time))
+
+
+def _expire_holds(conn, now, changes):
+    expired = conn.execute("SELECT user_id, date, time FROM slot_holds WHERE expires_at < ?", (now,)).fetchall()
+    for user_id, date, time in expired:
+        _release(conn, date, time)
+        changes.append((date, time, +1))
+    if expired:
+        conn.execute("DELETE FROM slot_holds WHERE expires_at < ?", (now,))
+
+
+def _take(conn, date, time):
+    """زيادة taken ذرياً إن بقي مكان؛ صف واحد معدَّل يعني النجاح"""
+    cur = conn.execute(
+        "UPDATE slots SET taken = taken + 1 WHERE date=? AND time=? AND taken < capacity", (date, time)
+    )
+    return cur.rowcount == 1
+
+
+class SlotEngine:
+    """كل التغييرات تمر بمعاملة على كاتب Storage، ثم تُطبَّق فروقها على ذاكرة المتاح
+    فعرض الأيام والأوقات لا يقرأ من القاعدة أبداً"""
+
+    def __init__(self, storage, times, working_days=(6, 0, 1, 2, 3), capacity=3,
+                 horizon_days=7, hold_minutes=10, refresh_interval=60):
+        self.storage = storage
+        self.times = dict(times)  # {"13:00": "1 ظهراً", ...}
+        self.working_days = set(working_days)
+        self.capacity = capacity
+        self.horizon_days = horizon_days
+        self.hold_seconds = hold_minutes * 60
+        self.refresh_interval = refresh_interval
+        self._available = {}  # {date: {time: remaining}}
+        self._task = None
+
+    # ---------- التقويم ----------
+    def _calendar(self):
+        today = Date.today()
+        return [
+            (today + timedelta(days=i)).isoformat()
+            for i in range(self.horizon_days)
+            if (today + timedelta(days=i)).weekday() in self.working_days
+        ]
+
+    @staticmethod
+    def day_label(date):
+        try:
+            d = Date.fromisoformat(date)
+        except ValueError:
+            # أزرار قديمة تحمل اسم اليوم بدل التاريخ
+            return date
+        return f"{WEEKDAY_NAMES[d.weekday()]} {d.day}/{d.month}"
+
+    def time_label(self, time):
+        return self.times.get(time, time)
+
+    def is_past(self, date, time):
+        return datetime.fromisoformat(f"{date} {time}") <= datetime.now()
+
+    # ---------- ذاكرة المتاح ----------
+    def days(self):
+        """الأيام القادمة التي فيها مكان متاح"""
+        return [
+            date for date in self._calendar()
+            if any(remaining > 0 and not self.is_past(date, time)
+                   for time, remaining in self._available.get(date, {}).items())
+        ]
+
+    def slots(self, date):
+        """[(الوقت، المتبقي)] لليوم المعطى مرتبة حسب الوقت"""
+        return [
+            (time, remaining) for time, remaining in sorted(self._available.get(date, {}).items())
+            if remaining > 0 and not self.is_past(date, time)
+        ]
+
+    def _apply(self, changes):
+        for date, time, delta in changes:
+            day = self._available.get(date)
+            if day is not None and time in day:
+                day[time] += delta
+
+    async def refresh(self):
+        """إنشاء صفوف الأيام الجديدة، تحرير الحجوزات المؤقتة المنتهية، وإعادة بناء الذاكرة من جدول slots"""
+        calendar = self._calendar()
+
+        def run(conn):
+            conn.executemany(
+                """INSERT INTO slots (date, time, capacity) VALUES (?, ?, ?)
+                   ON CONFLICT(date, time) DO UPDATE SET capacity=MAX(excluded.capacity, taken)""",
+                [(date, time, self.capacity) for date in calendar for time in self.times]
+            )
+            _expire_holds(conn, clock.time(), [])
+            return conn.execute(
+                "SELECT date, time, capacity - taken FROM slots WHERE date >= ? AND date <= ?",
+                (calendar[0], calendar[-1])
+            ).fetchall() if calendar else []
+
+        rows = await self.storage.write(run, op="slots.refresh")
+        available = {}
+        for date, time, remaining in rows:
+            if time in self.times:
+                available.setdefault(date, {})[time] = remaining
+        self._available = available
+
+    # ---------- الحجز ----------
+    async def hold(self, user_id, date, time):
+        """حجز مؤقت للمستخدم؛ يحرر حجزه المؤقت السابق إن وجد. يعيد False إن امتلأ الموعد"""
+        if date not in self._available or time not in self.times or self.is_past(date, time):
+            return False
+        now = clock.time()
+
+        def run(conn):
+            changes = []
+            _expire_holds(conn, now, changes)
+            previous = conn.execute("SELECT date, time FROM slot_holds WHERE user_id=?", (user_id,)).fetchone()
+            if previous:
+                _release(conn, *previous)
+                conn.execute("DELETE FROM slot_holds WHERE user_id=?", (user_id,))
+                changes.append((*previous, +1))
+            if not _take(conn, date, time):
+                return False, changes
+            conn.execute(
+                "INSERT INTO slot_holds (user_id, date, time, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, date, time, now + self.hold_seconds)
+            )
+            changes.append((date, time, -1))
+            return True, changes
+
+        ok, changes = await self.storage.write(run, op="slots.hold")
+        self._apply(changes)
+        return ok
+
+    async def confirm(self, user_id, name, phone, date, time):
+        """تحويل الحجز المؤقت إلى حجز مؤكد في معاملة واحدة. إن كان الحجز المؤقت قد انتهى
+        يُحاوَل أخذ مكان جديد في نفس الموعد. يعيد معرّف الحجز أو None إن امتلأ الموعد"""
+        def run(conn):
+            changes = []
+            held = conn.execute(
+                "DELETE FROM slot_holds WHERE user_id=? AND date=? AND time=?", (user_id, date, time)
+            ).rowcount
+            if not held:
+                if not _take(conn, date, time):
+                    return None, changes
+                changes.append((date, time, -1))
+            cur = conn.execute(
+                "INSERT INTO bookings (user_id, name, phone, date, time, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, name, phone, date, time, datetime.now())
+            )
+            return cur.lastrowid, changes
+
+        booking_id, changes = await self.storage.write(run, op="slots.confirm")
+        self._apply(changes)
+        return booking_id
+
+    async def release(self, user_id):
+        """إلغاء الحجز المؤقت للمستخدم (مثلاً عند /start)"""
+        def run(conn):
+            held = conn.execute("SELECT date, time FROM slot_holds WHERE user_id=?", (user_id,)).fetchone()
+            if not held:
+                return []
+            _release(conn, *held)
+            conn.execute("DELETE FROM slot_holds WHERE user_id=?", (user_id,))
+            return [(*held, +1)]
+
+        self._apply(await self.storage.write(run, op="slots.release"))
+
+    # ---------- التشغيل ----------
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("تعذر تحديث المواعيد المتاحة")
+
+    async def start(self):
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
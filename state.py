@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""حالة المحادثة المنظَّمة وذاكرة تخزين مؤقت لها أمام جدول users"""
+
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+LEGACY_BOOKING_PREFIXES = ("waiting_name_", "waiting_phone_")
+
+
+@dataclass(frozen=True)
+class UserState:
+    """خطوة المحادثة الحالية مع بياناتها (مثل التاريخ والوقت والاسم أثناء الحجز)"""
+    step: str
+    payload: dict = field(default_factory=dict)
+
+    def encode(self):
+        """تمثيل مختصر للتخزين: اسم الخطوة وحده إن لم توجد بيانات"""
+        if not self.payload:
+            return self.step
+        return json.dumps([self.step, self.payload], ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def decode(cls, raw):
+        if not raw:
+            return None
+        if raw.startswith("["):
+            step, payload = json.loads(raw)
+            return cls(step, payload)
+        # حالات الحجز القديمة (waiting_name_<التاريخ>_<الوقت> وwaiting_phone_..._<الاسم>) لا تقابل خطوة
+        # يعرفها معالج، ولا حجز مؤقت لموعدها، فتُعامل كعدم وجود حالة ويبدأ صاحبها الحجز من جديد
+        if raw.startswith(LEGACY_BOOKING_PREFIXES):
+            return None
+        # الحالات القديمة الأخرى المخزنة كنص عادي
+        return cls(raw)
+
+
+# علامة عدم وجود المستخدم في الذاكرة (تختلف عن حالة None المخزنة)
+MISSING = object()
+
+
+class StateCache:
+    """LRU مع مدة صلاحية: الأقدم استخداماً في المقدمة فيُطرد المنتهي والزائد من هناك"""
+
+    def __init__(self, max_size=10000, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """يعيد الحالة (قد تكون None) أو MISSING إن لم تكن في الذاكرة"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return MISSING
+        state, expires_at = entry
+        now = time.monotonic()
+        if expires_at < now:
+            del self._entries[user_id]
+            return MISSING
+        # مدة الصلاحية تُحسب من آخر استخدام، فيبقى الترتيب حسب الاستخدام هو نفسه ترتيب الانتهاء
+        self._entries[user_id] = (state, now + self.ttl)
+        self._entries.move_to_end(user_id)
+        return state
+
+    def put(self, user_id, state):
+        now = time.monotonic()
+        self._entries[user_id] = (state, now + self.ttl)
+        self._entries.move_to_end(user_id)
+        self._evict(now)
+
+    def discard(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def _evict(self, now):
+        entries = self._entries
+        while entries:
+            oldest, (_, expires_at) = next(iter(entries.items()))
+            if len(entries) <= self.max_size and expires_at >= now:
+                break
+            del entries[oldest]
+
+
+class RecentIds:
+    """آخر max_size معرّف بترتيب الإضافة، لكشف التكرار دون استعلام"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, key):
+        """يعيد False إن كان المعرّف موجوداً مسبقاً"""
+        if key in self._ids:
+            return False
+        self._ids[key] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+        return True
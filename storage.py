@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""طبقة التخزين: اتصالات SQLite طويلة العمر بوضع WAL تعمل خارج حلقة الأحداث"""
+
+import asyncio
+import logging
+import sqlite3
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from metrics import DB_ERRORS, DB_SECONDS, DB_SLOW, DB_WAIT_SECONDS
+from migrations import migrate
+from search import normalize
+from state import MISSING, RecentIds, StateCache, UserState
+
+logger = logging.getLogger(__name__)
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def statement_label(query):
+    """تصنيف قصير ثابت للاستعلام في المقاييس: "SELECT users"، "UPDATE slots"..."""
+    verb = query.split(None, 1)[0].upper() if query.strip() else "?"
+    table = _TABLE.search(query)
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+def _run_query(conn, query, params):
+    conn.execute(query, params)
+
+
+def _fetch_query(conn, query, params):
+    return conn.execute(query, params).fetchall()
+
+
+class WriteBuffer:
+    """كتابة مؤجلة للسجلات غير الحرجة (الرسائل وآخر ظهور) تُفرَّغ دفعةً واحدة في معاملة واحدة"""
+
+    def __init__(self, storage, flush_ms=200, max_rows=100, stop_attempts=5):
+        self.storage = storage
+        self.stop_attempts = stop_attempts
+        self.flush_interval = flush_ms / 1000
+        self.max_rows = max_rows
+        self._messages = []
+        self._last_seen = {}
+        self._updates = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def __len__(self):
+        return len(self._messages) + len(self._last_seen) + len(self._updates)
+
+    def add_message(self, user_id, username, message_text, message_type):
+        self._messages.append((user_id, username, message_text, message_type, datetime.now()))
+        self._maybe_wake()
+
+    def touch(self, user_id):
+        # آخر ظهور يُدمج لكل مستخدم: يكفي آخر وقت قبل التفريغ
+        self._last_seen[user_id] = datetime.now()
+        self._maybe_wake()
+
+    def add_update(self, update_id):
+        self._updates.append((update_id, datetime.now()))
+        self._maybe_wake()
+
+    def _maybe_wake(self):
+        if len(self) >= self.max_rows:
+            self._wakeup.set()
+
+    async def flush(self):
+        if not len(self):
+            return
+        messages, self._messages = self._messages, []
+        last_seen, self._last_seen = self._last_seen, {}
+        updates, self._updates = self._updates, []
+
+        def write_batch(conn):
+            conn.executemany(
+                "INSERT INTO messages (user_id, username, message_text, message_type, created_at) VALUES (?, ?, ?, ?, ?)",
+                messages
+            )
+            conn.executemany(
+                "UPDATE users SET last_message=? WHERE user_id=?",
+                [(seen, user_id) for user_id, seen in last_seen.items()]
+            )
+            # في نفس معاملة الرسائل: التحديث الذي ضاعت رسالته مع انقطاع مفاجئ لا يُعدّ معالجاً
+            conn.executemany("INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?, ?)", updates)
+        try:
+            await self.storage.write(write_batch, op="buffer.flush")
+        except Exception:
+            # فشلت المعاملة كاملة (قفل، قرص ممتلئ...): تعود الصفوف قبل ما أضيف بعدها وتُعاد المحاولة في التفريغ التالي
+            self._messages = messages + self._messages
+            self._last_seen = {**last_seen, **self._last_seen}
+            self._updates = updates + self._updates
+            raise
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("تعذّر تفريغ دفعة الكتابة المؤجلة")
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """إيقاف المؤقت مع تفريغ مضمون لما تبقّى"""
+        if self._task is not None:
+            # لا إلغاء للمهمة: إلغاء تفريغ ينتظر خيط الكاتب يُسقط صفوفه بصمت (أو يكررها إن بدأت كتابتها)،
+            # فتُنبَّه لتنهي دورتها الحالية وتخرج
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        for attempt in range(self.stop_attempts):
+            try:
+                await self.flush()
+                return
+            except Exception:
+                logger.exception(f"تعذّر تفريغ الكتابة المؤجلة عند الإيقاف (المحاولة {attempt + 1})")
+                await asyncio.sleep(2 ** attempt)
+        logger.error(f"❌ فُقد {len(self)} صف من الكتابة المؤجلة بعد {self.stop_attempts} محاولات")
+
+
+class Storage:
+    """كاتب واحد ومجموعة قرّاء، كل استعلام ينفَّذ في خيط منفصل عن حلقة الأحداث"""
+
+    def __init__(self, path, readers=4, flush_ms=200, flush_rows=100, cache_size=10000, cache_ttl=1800,
+                 slow_ms=100, recent_updates=10000):
+        self.path = path
+        self.readers = readers
+        # العمليات الأبطأ من slow_ms تُسجَّل في السجل مع نص الاستعلام
+        self.slow_seconds = slow_ms / 1000
+        self.buffer = WriteBuffer(self, flush_ms, flush_rows)
+        self.states = StateCache(cache_size, cache_ttl)
+        # update_id للتحديثات الأخيرة (المعالجة والجارية)، يُملأ من processed_updates عند الفتح
+        self.updates = RecentIds(recent_updates)
+        self._writer = None
+        self._readers = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # إجمالي الزمن داخل SQLite بالثواني (للقياس وأدوات الأداء)
+        self.db_seconds = 0.0
+
+    # ---------- الاتصالات ----------
+    def _connection(self, synchronous="NORMAL"):
+        """اتصال واحد لكل خيط، يُفتح عند أول استخدام ويبقى مفتوحاً"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={synchronous}")
+            conn.execute("PRAGMA busy_timeout=5000")
+            # مشغلات فهرس البحث تستدعيها، فيجب أن تكون مسجلة على كل اتصال يكتب في messages
+            conn.create_function("ar_norm", 1, normalize, deterministic=True)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _timed(self, kind, op, queued, run, fn, args):
+        """تنفيذ العملية مع قياس زمن الانتظار في طابور الخيط وزمن التنفيذ وتسجيل البطيء والفاشل منها"""
+        started = time.perf_counter()
+        DB_WAIT_SECONDS.observe(started - queued, kind)
+        try:
+            return run()
+        except Exception as e:
+            DB_ERRORS.inc(kind, op, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.db_seconds += elapsed
+            DB_SECONDS.observe(elapsed, kind, op)
+            if elapsed >= self.slow_seconds:
+                DB_SLOW.inc(kind, op)
+                logger.warning(f"🐢 عملية {kind} بطيئة ({elapsed * 1000:.0f} ms): {self._describe(fn, args, op)}")
+
+    @staticmethod
+    def _describe(fn, args, op):
+        # نص الاستعلام نفسه لما يمر عبر execute، واسم العملية لغيره
+        return " ".join(args[0].split()) if fn in (_run_query, _fetch_query) else op
+
+    def _write(self, fn, args, op, queued):
+        # FULL على الكاتب: مع NORMAL في وضع WAL قد تُفقد آخر المعاملات المؤكدة (حجز، حالة) عند انقطاع
+        # الكهرباء أو تعطل النظام. الكتابة المؤجلة تجمع الرسائل في معاملة واحدة فتبقى كلفة fsync محدودة
+        conn = self._connection("FULL")
+
+        def run():
+            with conn:
+                return fn(conn, *args)
+        return self._timed("write", op, queued, run, fn, args)
+
+    def _read(self, fn, args, op, queued):
+        return self._timed("read", op, queued, lambda: fn(self._connection(), *args), fn, args)
+
+    async def write(self, fn, *args, op=None):
+        """تنفيذ fn(conn, *args) داخل معاملة واحدة على خيط الكاتب. op اسم العملية في المقاييس"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._writer, self._write, fn, args, op or fn.__name__, time.perf_counter()
+        )
+
+    async def read(self, fn, *args, op=None):
+        """تنفيذ fn(conn, *args) على أحد خيوط القراءة"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, self._read, fn, args, op or fn.__name__, time.perf_counter()
+        )
+
+    async def execute(self, query, params=(), fetch=False):
+        """بديل db_execute: القراءة على القرّاء والكتابة على الكاتب"""
+        op = statement_label(query)
+        if fetch:
+            return await self.read(_fetch_query, query, params, op=op)
+        await self.write(_run_query, query, params, op=op)
+
+    async def open(self):
+        # المنفّذات تُنشأ هنا لا في __init__ حتى يمكن إعادة الفتح بعد close()
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+
+        def auto_vacuum(conn):
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # incremental_vacuum (retention.py) يحتاج auto_vacuum=INCREMENTAL، ولا يتغير الوضع
+                # لقاعدة فيها جداول إلا بـ VACUUM كامل، فيحدث ذلك مرة واحدة فقط
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+                    logger.info("🧹 تحويل قاعدة البيانات إلى auto_vacuum=INCREMENTAL (VACUUM لمرة واحدة)")
+                    conn.execute("VACUUM")
+        await self.write(auto_vacuum, op="auto_vacuum")
+        await self.write(migrate, op="migrate")
+        # من جديد في كل فتح: ما حُجز ولم تكتمل معالجته في محاولة تعطلت يُعالج في التالية
+        self.updates = RecentIds(self.updates.max_size)
+        await self.load_processed_updates()
+        self.buffer.start()
+
+    async def close(self):
+        if self._writer is None:
+            return
+        await self.buffer.stop()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self._writer = self._readers = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    # ---------- المستخدمون ----------
+    async def get_user_state(self, user_id):
+        """UserState أو None، من الذاكرة في الحالة الشائعة"""
+        state = self.states.get(user_id)
+        if state is MISSING:
+            res = await self.execute("SELECT state FROM users WHERE user_id=?", (user_id,), fetch=True)
+            state = UserState.decode(res[0][0]) if res else None
+            self.states.put(user_id, state)
+        return state
+
+    async def set_user_state(self, user_id, state, username=None):
+        """كتابة فورية في القاعدة ثم تحديث الذاكرة (write-through)"""
+        # UPSERT بدل INSERT OR REPLACE حتى لا يُمسح اسم المستخدم مع كل تغيير حالة
+        await self.execute(
+            """INSERT INTO users (user_id, username, state, last_message) VALUES (?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET
+                   state=excluded.state,
+                   last_message=excluded.last_message,
+                   username=COALESCE(excluded.username, users.username)""",
+            (user_id, username, state.encode() if state else None, datetime.now())
+        )
+        self.states.put(user_id, state)
+
+    async def clear_user_state(self, user_id):
+        await self.execute("UPDATE users SET state=NULL WHERE user_id=?", (user_id,))
+        self.states.put(user_id, None)
+
+    def update_last_message(self, user_id):
+        """تحديث مؤجل عبر WriteBuffer"""
+        self.buffer.touch(user_id)
+
+    # ---------- التحديثات ----------
+    async def load_processed_updates(self):
+        rows = await self.execute(
+            "SELECT update_id FROM processed_updates ORDER BY processed_at DESC LIMIT ?",
+            (self.updates.max_size,), fetch=True
+        )
+        for (update_id,) in reversed(rows):
+            self.updates.add(update_id)
+
+    def claim_update(self, update_id):
+        """False إن كان التحديث قد عولج أو تجري معالجته الآن"""
+        return self.updates.add(update_id)
+
+    def complete_update(self, update_id):
+        """تسجيل مؤجل عبر WriteBuffer بعد انتهاء معالجة التحديث"""
+        self.buffer.add_update(update_id)
+
+    # ---------- الرسائل ----------
+    # الحجوزات تُكتب عبر SlotEngine.confirm في نفس معاملة تحرير الحجز المؤقت
+    def save_message(self, user_id, username, message_text, message_type):
+        """حفظ الرسالة في قاعدة البيانات (كتابة مؤجلة عبر WriteBuffer)"""
+        self.buffer.add_message(user_id, username, message_text, message_type)
+
+    async def save_media_message(self, user_id, username, message_text, message_type, media):
+        """كتابة فورية (لا عبر WriteBuffer) لأن الملف يُربط بمعرّف صف الرسالة.
+        تعيد (معرّف الرسالة، مسار الملف في المخزن أو None إن لم يُنزَّل بعد)"""
+        def run(conn):
+            message_id = conn.execute(
+                "INSERT INTO messages (user_id, username, message_text, message_type, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, username, message_text, message_type, datetime.now())
+            ).lastrowid
+            # file_id قد يتغير بين إرسالين لنفس الملف، فيُحدَّث بالأحدث
+            conn.execute(
+                """INSERT INTO attachments (file_unique_id, file_id, kind, file_name, mime_type, file_size, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(file_unique_id) DO UPDATE SET file_id=excluded.file_id""",
+                (media.file_unique_id, media.file_id, media.kind, media.file_name, media.mime_type,
+                 media.file_size, datetime.now())
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO message_attachments (message_id, file_unique_id) VALUES (?, ?)",
+                (message_id, media.file_unique_id)
+            )
+            path = conn.execute("SELECT path FROM attachments WHERE file_unique_id=?", (media.file_unique_id,)).fetchone()
+            return message_id, path[0]
+        return await self.write(run, op="media.save")
+
+    async def attachment_path(self, file_unique_id):
+        res = await self.execute("SELECT path FROM attachments WHERE file_unique_id=?", (file_unique_id,), fetch=True)
+        return res[0][0] if res else None
+
+    async def set_attachment_path(self, file_unique_id, sha256, path):
+        await self.execute(
+            "UPDATE attachments SET sha256=?, path=? WHERE file_unique_id=?", (sha256, path, file_unique_id)
+        )
+
+    # ---------- عروض الأدمن ----------
+    async def _keyset_page(self, table, columns, filters, before, after, limit):
+        """صفحة مرتبة تنازلياً على id بترقيم keyset: before للأقدم وafter للأحدث.
+        تعيد (الصفوف، يوجد أحدث، يوجد أقدم) بكلفة ثابتة مهما كبر الجدول"""
+        where = [f"{column}=?" for column in filters]
+        params = list(filters.values())
+        if after is not None:
+            where.append("id>?")
+            params.append(after)
+            order = "ASC"
+        else:
+            if before is not None:
+                where.append("id<?")
+                params.append(before)
+            order = "DESC"
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        rows = await self.execute(
+            f"SELECT id, {columns} FROM {table} {clause} ORDER BY id {order} LIMIT ?",
+            (*params, limit + 1), fetch=True
+        )
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if after is not None:
+            return rows[::-1], more, True
+        return rows, before is not None, more
+
+    async def page_messages(self, message_type=None, user_id=None, before=None, after=None, limit=15):
+        filters = {}
+        if message_type:
+            filters["message_type"] = message_type
+        if user_id:
+            filters["user_id"] = user_id
+        return await self._keyset_page(
+            "messages", "user_id, username, message_text, message_type, created_at",
+            filters, before, after, limit
+        )
+
+    async def page_bookings(self, date=None, before=None, after=None, limit=10):
+        filters = {"date": date} if date else {}
+        return await self._keyset_page(
+            "bookings", "name, phone, date, time", filters, before, after, limit
+        )
+
+    # ---------- البحث ----------
+    async def search_messages(self, match, offset=0, limit=10, window=2000, before=None):
+        """صفحة من نتائج البحث مرتبة بـ bm25 (الأكثر صلة أولاً). match استعلام FTS5 من search.match_query.
+        الترتيب يشمل نافذة من أحدث window تطابق فقط (قبل الرسالة before إن حُدد): FTS5 يمر عليها بترتيب
+        rowid دون حساب bm25 لكل التاريخ، فتبقى كلفة الكلمات الشائعة ثابتة مهما كبر الجدول.
+        تعيد (الصفوف، يوجد المزيد في النافذة، before للنافذة الأقدم التالية أو None إن لم تكن ممتلئة)"""
+        bound, params = ("AND rowid < ?", (before,)) if before else ("", ())
+        matches = f"SELECT rowid, rank FROM messages_fts WHERE messages_fts MATCH ? {bound} ORDER BY rowid DESC LIMIT ?"
+
+        def run(conn):
+            rows = conn.execute(
+                f"""SELECT m.id, m.user_id, m.username, m.message_text, m.message_type, m.created_at
+                    FROM ({matches}) f JOIN messages m ON m.id = f.rowid
+                    ORDER BY f.rank, f.rowid DESC LIMIT ? OFFSET ?""",
+                (match, *params, window, limit + 1, offset)
+            ).fetchall()
+            older = None
+            if len(rows) <= limit:
+                # آخر صفحة في النافذة: إن امتلأت فقد توجد تطابقات أقدم منها
+                count, oldest = conn.execute(
+                    f"SELECT COUNT(*), MIN(rowid) FROM ({matches})", (match, *params, window)
+                ).fetchone()
+                older = oldest if count == window else None
+            return rows[:limit], len(rows) > limit, older
+        return await self.read(run, op="search_messages")
+
+    # ---------- الإحصاءات ----------
+    async def daily_stats(self, since):
+        """صفوف (اليوم، المقياس، المفتاح، القيمة) من since فصاعداً، بمسح مدى على المفتاح الأساسي"""
+        return await self.execute(
+            "SELECT day, metric, key, value FROM daily_stats WHERE day >= ? ORDER BY day", (since,), fetch=True
+        )
+
+    async def weekly_active(self, start, end):
+        """عدد المستخدمين المختلفين الذين ظهروا بين start وend (شاملاً)"""
+        res = await self.execute(
+            "SELECT COUNT(DISTINCT user_id) FROM daily_active WHERE day >= ? AND day <= ?", (start, end), fetch=True
+        )
+        return res[0][0]
+
+    async def total_users(self):
+        # عداد يحدّثه مشغل إضافة المستخدمين: قراءة صف واحد بالمفتاح الأساسي مهما كبر السجل
+        res = await self.execute(
+            "SELECT value FROM daily_stats WHERE day='' AND metric='total_users' AND key=''", fetch=True
+        )
+        return res[0][0] if res else 0
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""اختبار وضع webhook دون توكن حقيقي: التطبيق الفعلي من bot.py مع bench.FakeBotAPI بدل Bot API.
+
+    python -m pytest -q test_webhook.py   (أو python -m unittest test_webhook)"""
+
+import asyncio
+import os
+import signal
+import socket
+import tempfile
+import time
+import unittest
+
+import httpx
+
+from bench import BOT_ID, FakeBotAPI
+
+TMP = tempfile.mkdtemp(prefix="clinic-test-")
+# الإعدادات تُقرأ عند استيراد bot، فتُضبط قبله
+os.environ.update({
+    "BOT_TOKEN": f"{BOT_ID}:TEST",
+    "ADMIN_ID": "1",
+    "DB_PATH": os.path.join(TMP, "test.db"),
+    "ARCHIVE_DIR": os.path.join(TMP, "archive"),
+    "METRICS_PORT": "0",
+})
+
+import bot  # noqa: E402
+import webhook  # noqa: E402
+from sharding import ShardedUpdateProcessor  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+PATH = "/telegram"
+SECRET = "test-secret"
+# إشارة الإيقاف في الاختبار بدل SIGINT/SIGTERM حتى لا تتأثر عملية الاختبار نفسها
+STOP_SIGNAL = signal.SIGUSR1
+# زمن المعالج البطيء لكل تحديث
+HANDLER_SECONDS = 0.5
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def text_update(update_id, user_id=100, text="مرحبا"):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "test"},
+    }}
+
+
+class WebhookTest(unittest.TestCase):
+    """كل الاختبارات على حلقة أحداث واحدة: مكونات bot.py (طوابير الإشعارات والملفات) تُنشأ عند الاستيراد
+    وترتبط بأول حلقة تستخدمها، كما في مشرف التشغيل main()"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.loop = asyncio.new_event_loop()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.close()
+
+    def setUp(self):
+        self.loop.run_until_complete(self.start())
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.stop())
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    async def start(self):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}{PATH}"
+        # نفس معالج التحديثات في run(): متوازٍ بين المستخدمين ومتسلسل لكل مستخدم
+        self.app = bot.build_application(
+            concurrent_updates=ShardedUpdateProcessor(8, 1024), request=FakeBotAPI(), get_updates_request=FakeBotAPI()
+        )
+        self.handled = []
+        # update_id -> (user_id، بداية المعالجة، نهايتها)
+        self.spans = {}
+
+        async def slow_handler(update, context):
+            # معالجة بطيئة تمتد بعد إشارة الإيقاف، ليُختبر انتظارها
+            started = time.monotonic()
+            await asyncio.sleep(HANDLER_SECONDS)
+            self.handled.append(update.update_id)
+            self.spans[update.update_id] = (update.effective_user.id, started, time.monotonic())
+
+        self.app.add_handler(TypeHandler(Update, slow_handler), group=2)
+        self.server = asyncio.create_task(webhook.serve(
+            self.app, "127.0.0.1", self.port, PATH, secret=SECRET, stop_signals=(STOP_SIGNAL,)
+        ))
+        self.client = httpx.AsyncClient()
+        await self.wait_listening()
+
+    async def stop(self):
+        await self.client.aclose()
+        if not self.server.done():
+            os.kill(os.getpid(), STOP_SIGNAL)
+        await asyncio.wait_for(self.server, 10)
+
+    async def wait_listening(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.server.done():
+                self.server.result()
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            except OSError:
+                await asyncio.sleep(0.05)
+                continue
+            writer.close()
+            await writer.wait_closed()
+            return
+        self.fail("خادم webhook لم يبدأ الاستماع")
+
+    async def post(self, data, secret=SECRET):
+        headers = {webhook.SECRET_HEADER: secret} if secret else {}
+        return await self.client.post(self.url, json=data, headers=headers)
+
+    def test_accepts_update_with_secret(self):
+        self.run_async(self._test_accepts_update_with_secret())
+
+    async def _test_accepts_update_with_secret(self):
+        response = await self.post(text_update(1))
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_missing_or_wrong_secret(self):
+        self.run_async(self._test_rejects_missing_or_wrong_secret())
+
+    async def _test_rejects_missing_or_wrong_secret(self):
+        self.assertEqual((await self.post(text_update(2), secret=None)).status_code, 403)
+        self.assertEqual((await self.post(text_update(3), secret="wrong")).status_code, 403)
+        await asyncio.sleep(0.7)
+        self.assertEqual(self.handled, [])
+
+    def test_rejects_invalid_json(self):
+        self.run_async(self._test_rejects_invalid_json())
+
+    async def _test_rejects_invalid_json(self):
+        response = await self.client.post(self.url, content=b"{", headers={webhook.SECRET_HEADER: SECRET})
+        self.assertEqual(response.status_code, 400)
+
+    def test_shutdown_drains_in_flight_updates(self):
+        self.run_async(self._test_shutdown_drains_in_flight_updates())
+
+    async def _test_shutdown_drains_in_flight_updates(self):
+        for update_id in (10, 11, 12):
+            self.assertEqual((await self.post(text_update(update_id, user_id=100 + update_id))).status_code, 200)
+        # الإيقاف والمعالجات ما زالت تعمل: serve لا يعود قبل اكتمالها
+        os.kill(os.getpid(), STOP_SIGNAL)
+        await asyncio.wait_for(self.server, 10)
+        self.assertEqual(sorted(self.handled), [10, 11, 12])
+
+    def test_users_processed_concurrently_each_in_order(self):
+        self.run_async(self._test_users_processed_concurrently_each_in_order())
+
+    async def _test_users_processed_concurrently_each_in_order(self):
+        # سبعة مستخدمين في أجزاء مختلفة، وللمستخدم 205 ثلاثة تحديثات متتالية
+        updates = [(20, 201), (21, 202), (22, 203), (23, 204), (24, 205), (25, 205), (26, 205), (27, 206), (28, 207)]
+        for update_id, user_id in updates:
+            self.assertEqual((await self.post(text_update(update_id, user_id=user_id))).status_code, 200)
+        os.kill(os.getpid(), STOP_SIGNAL)
+        await asyncio.wait_for(self.server, 10)
+        self.assertEqual(sorted(self.spans), [update_id for update_id, _ in updates])
+
+        # بالتوازي: الزمن الكلي قريب من أطول تسلسل (3 تحديثات للمستخدم 205) لا من مجموع الأزمنة
+        elapsed = max(end for _, _, end in self.spans.values()) - min(start for _, start, _ in self.spans.values())
+        self.assertLess(elapsed, HANDLER_SECONDS * len(updates) / 2)
+
+        # تحديثات المستخدم الواحد بترتيب وصولها، ولا يبدأ أحدها قبل انتهاء سابقه
+        same_user = [update_id for update_id in self.handled if self.spans[update_id][0] == 205]
+        self.assertEqual(same_user, [24, 25, 26])
+        for previous, following in zip(same_user, same_user[1:]):
+            self.assertGreaterEqual(self.spans[following][1], self.spans[previous][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
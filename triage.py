@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""طابور طلبات المرضى: حالة كل طلب (مفتوح/تم الرد/مغلق)، ربط إشعارات الأدمن بأصحابها، ومتابعة مهلة الرد"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# مستويات تنبيه المهلة المحفوظة في sla_level
+SLA_NONE, SLA_WARNED, SLA_OVERDUE = 0, 1, 2
+
+
+class Triage:
+    """كل طلب مصنف (استفسار، تعديل نظام، تحليل...) يُفتح كصف في requests ويبقى مفتوحاً حتى يرد الأدمن.
+    رسائل الإشعار المرسلة للأدمن تُربط في admin_links بالمستخدم والطلب، فالرد عليها يصل لصاحبها"""
+
+    def __init__(self, storage, notifier, sla_hours=48, warn_hours=36, check_interval=900):
+        self.storage = storage
+        self.notifier = notifier
+        self.sla = timedelta(hours=sla_hours)
+        self.warn = timedelta(hours=warn_hours)
+        self.check_interval = check_interval
+        self._task = None
+
+    # ---------- الطلبات ----------
+    async def open_request(self, user_id, request_type, summary):
+        def run(conn):
+            return conn.execute(
+                "INSERT INTO requests (user_id, type, summary, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, request_type, summary[:200], datetime.now())
+            ).lastrowid
+        return await self.storage.write(run, op="triage.open")
+
+    async def get(self, request_id):
+        """(user_id, type, status) أو None"""
+        res = await self.storage.execute(
+            "SELECT user_id, type, status FROM requests WHERE id=?", (request_id,), fetch=True
+        )
+        return res[0] if res else None
+
+    async def set_status(self, request_id, status):
+        """إنهاء طلب مفتوح (answered أو closed)؛ يعيد False إن لم يكن مفتوحاً"""
+        def run(conn):
+            return conn.execute(
+                "UPDATE requests SET status=?, answered_at=? WHERE id=? AND status='open'",
+                (status, datetime.now(), request_id)
+            ).rowcount == 1
+        return await self.storage.write(run, op="triage.status")
+
+    async def open_requests(self, request_type=None, limit=15):
+        """أقدم الطلبات المفتوحة أولاً: (id، user_id، النوع، الملخص، وقت الإنشاء)"""
+        where, params = "status='open'", []
+        if request_type:
+            where += " AND type=?"
+            params.append(request_type)
+        return await self.storage.execute(
+            f"SELECT id, user_id, type, summary, created_at FROM requests WHERE {where} ORDER BY created_at LIMIT ?",
+            (*params, limit), fetch=True
+        )
+
+    async def open_counts(self):
+        """{النوع: عدد المفتوح}، من الفهرس (status, type, created_at) وحده"""
+        rows = await self.storage.execute(
+            "SELECT type, COUNT(*) FROM requests WHERE status='open' GROUP BY type", fetch=True
+        )
+        return dict(rows)
+
+    # ---------- ربط رسائل الأدمن ----------
+    async def link(self, admin_message_id, user_id, request_id=None):
+        await self.storage.execute(
+            "INSERT OR REPLACE INTO admin_links (admin_message_id, user_id, request_id, created_at) VALUES (?, ?, ?, ?)",
+            (admin_message_id, user_id, request_id, datetime.now())
+        )
+
+    async def lookup(self, admin_message_id):
+        """(user_id, request_id) لرسالة إشعار في محادثة الأدمن، أو None"""
+        res = await self.storage.execute(
+            "SELECT user_id, request_id FROM admin_links WHERE admin_message_id=?", (admin_message_id,), fetch=True
+        )
+        return res[0] if res else None
+
+    # ---------- مهلة الرد ----------
+    async def check_sla(self, now=None):
+        """تنبيه واحد لكل طلب عند اقترابه من المهلة وآخر عند تجاوزها؛ يعيد عدد التنبيهات"""
+        now = now or datetime.now()
+        warn_before, overdue_before = now - self.warn, now - self.sla
+
+        def run(conn):
+            due = {}
+            for level, cutoff in ((SLA_OVERDUE, overdue_before), (SLA_WARNED, warn_before)):
+                rows = conn.execute(
+                    """SELECT id, user_id, type, created_at FROM requests
+                       WHERE status='open' AND created_at < ? AND sla_level < ? ORDER BY created_at""",
+                    (cutoff, level)
+                ).fetchall()
+                rows = [row for row in rows if row[0] not in due]
+                conn.executemany("UPDATE requests SET sla_level=? WHERE id=?", [(level, row[0]) for row in rows])
+                due.update((row[0], (level, row)) for row in rows)
+            return list(due.values())
+
+        due = await self.storage.write(run, op="triage.sla")
+        for level, (request_id, user_id, request_type, created_at) in due:
+            age = int((now - datetime.fromisoformat(str(created_at))).total_seconds() // 3600)
+            if level == SLA_OVERDUE:
+                text = f"🚨 الطلب #{request_id} ({request_type}) تجاوز مهلة الرد: منذ {age} ساعة (ID: {user_id})"
+            else:
+                text = f"⏰ الطلب #{request_id} ({request_type}) يقترب من مهلة الرد: منذ {age} ساعة (ID: {user_id})"
+            self.notifier.notify("sla", text)
+        return len(due)
+
+    # ---------- التشغيل ----------
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check_sla()
+            except Exception:
+                logger.exception("تعذر فحص مهلة الرد على الطلبات")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
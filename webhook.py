@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""وضع webhook: خادم HTTP محلي يستقبل التحديثات من Telegram ويضعها في طابور التطبيق"""
+
+import asyncio
+import json
+import logging
+import signal
+from http import HTTPStatus
+
+from telegram import Update
+
+from httpserver import HTTPServer, Response
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookServer:
+    """يرد على Telegram فوراً بعد وضع التحديث في الطابور؛ المعالجة نفسها يتولاها التطبيق بالتوازي"""
+
+    def __init__(self, app, path="/telegram", secret=None):
+        self.app = app
+        self.path = path
+        self.secret = secret
+        self.http = HTTPServer({("POST", path): self.handle})
+
+    async def handle(self, request):
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return Response(HTTPStatus.FORBIDDEN)
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(HTTPStatus.BAD_REQUEST, "invalid JSON")
+        update = Update.de_json(data, self.app.bot)
+        await self.app.update_queue.put(update)
+        return Response(HTTPStatus.OK)
+
+    async def start(self, host, port):
+        port = await self.http.start(host, port)
+        logger.info(f"🌐 webhook يستمع على {host}:{port}{self.path}")
+        return port
+
+    async def stop(self):
+        await self.http.stop()
+
+
+async def serve(app, host, port, path="/telegram", url=None, secret=None, stop_signals=(signal.SIGINT, signal.SIGTERM)):
+    """تشغيل التطبيق بوضع webhook حتى وصول إشارة الإيقاف، بنفس دورة حياة run_polling:
+    post_init ثم الاستقبال، وعند الإيقاف: غلق الخادم، تفريغ التحديثات الجارية، post_stop، post_shutdown"""
+    server = WebhookServer(app, path, secret)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in stop_signals:
+        loop.add_signal_handler(sig, stopping.set)
+
+    try:
+        # داخل try حتى يُستدعى shutdown وpost_shutdown إن فشل post_init، كما في run_polling
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await server.start(host, port)
+        if url:
+            await app.bot.set_webhook(
+                url, secret_token=secret, allowed_updates=Update.ALL_TYPES, drop_pending_updates=False
+            )
+        await app.start()
+        await stopping.wait()
+        logger.info("⏹️ إيقاف webhook: انتظار التحديثات الجارية")
+    finally:
+        await server.stop()
+        if app.running:
+            # stop() يعالج ما تبقى في الطابور وينتظر المهام الجارية قبل العودة
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        for sig in stop_signals:
+            loop.remove_signal_handler(sig)